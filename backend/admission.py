@@ -0,0 +1,201 @@
+"""
+Admission control for expensive FlySnipe endpoints.
+
+Each endpoint class (flight search, checkout) gets a gate combining
+per-client token buckets with a global concurrency limit and a short,
+bounded wait queue. Requests that cannot be admitted quickly are shed with
+429 (client over its rate) or 503 (server saturated) plus Retry-After.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from fastapi import HTTPException, Request
+
+from timing import phase
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+
+class ClientBuckets:
+    """Per-client token buckets, bounded to the most recently seen clients"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Consume one token; return 0 if admitted, else seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+
+class AdmissionGate:
+    """Concurrency limit plus bounded wait queue for one endpoint class"""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        queue_size: int,
+        queue_timeout: float,
+        rate: float,
+        burst: float,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.buckets = ClientBuckets(rate, burst)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.shed_rate_limited = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    def _shed(self, status_code: int, retry_after: float, detail: str):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, client_key: str):
+        retry_after = self.buckets.take(client_key)
+        if retry_after:
+            self.shed_rate_limited += 1
+            self._shed(429, retry_after, "Too many requests")
+
+        if self._semaphore.locked():
+            if self.queue_depth >= self.queue_size:
+                self.shed_queue_full += 1
+                self._shed(503, self.queue_timeout, "Server busy, please retry")
+
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed_timeout += 1
+                self._shed(503, self.queue_timeout, "Server busy, please retry")
+            finally:
+                self.queue_depth -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def metrics(self) -> Dict:
+        return {
+            "concurrency_limit": self.concurrency,
+            "queue_limit": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "shed": {
+                "rate_limited": self.shed_rate_limited,
+                "queue_full": self.shed_queue_full,
+                "queue_timeout": self.shed_timeout,
+                "total": self.shed_rate_limited + self.shed_queue_full + self.shed_timeout,
+            },
+        }
+
+
+# Endpoint class defaults: (concurrency, queue size, client rate/s, client burst)
+ENDPOINT_CLASSES = {
+    "search": (64, 128, 2.0, 10),
+    "checkout": (16, 32, 0.2, 5),
+}
+
+
+def build_gates() -> Dict[str, AdmissionGate]:
+    """Create one gate per endpoint class, overridable via ADMISSION_<CLASS>_* env vars"""
+    queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "250")) / 1000
+    gates = {}
+    for name, (concurrency, queue_size, rate, burst) in ENDPOINT_CLASSES.items():
+        prefix = f"ADMISSION_{name.upper()}_"
+        gates[name] = AdmissionGate(
+            name,
+            concurrency=int(os.environ.get(prefix + "CONCURRENCY", concurrency)),
+            queue_size=int(os.environ.get(prefix + "QUEUE", queue_size)),
+            queue_timeout=queue_timeout,
+            rate=float(os.environ.get(prefix + "RATE", rate)),
+            burst=float(os.environ.get(prefix + "BURST", burst)),
+        )
+    return gates
+
+
+# Proxies in front of the API that append the peer they saw to X-Forwarded-For
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "1"))
+
+
+def client_ip(request: Request) -> str:
+    """The caller's address as seen by the outermost trusted proxy
+
+    Each proxy appends the address it received the request from, so entries
+    to the left of the trusted hops are whatever the client sent and are
+    ignored.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_COUNT <= 0:
+        return peer
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if len(forwarded) >= TRUSTED_PROXY_COUNT:
+        return forwarded[-TRUSTED_PROXY_COUNT]
+    return peer
+
+
+def client_key(request: Request) -> str:
+    """Identify the caller by IP; nothing the client chooses freely is used"""
+    return f"ip:{client_ip(request)}"
+
+
+def admission_guard(endpoint_class: str):
+    """FastAPI dependency holding an admission slot for the duration of the request"""
+
+    async def guard(request: Request):
+        gate: AdmissionGate = request.app.state.admission[endpoint_class]
+        with phase("admission"):
+            await gate.acquire(client_key(request))
+        try:
+            yield
+        finally:
+            gate.release()
+
+    return guard
@@ -0,0 +1,105 @@
+"""
+Recently authenticated users, cached per worker, and session tokens.
+
+Logins come in bursts (every extension instance re-authenticates after an
+update), so the user returned by a login is kept for a short TTL and
+repeat logins within it are answered without touching the database.
+
+A login also returns a session token: the email and an expiry signed with
+SESSION_SECRET. Callers send it as `Authorization: Bearer <token>`, and it
+is the only way a request is attributed to a user (for search quotas);
+emails the client sends directly are never trusted.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+
+
+class RecentUsers:
+    """Login responses by email for ttl seconds, bounded to the most recent users"""
+
+    def __init__(self, ttl: float, max_users: int):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+
+    def get(self, email: str) -> Optional[Dict]:
+        cached = self._users.get(email)
+        if cached is None:
+            return None
+        user, expires = cached
+        if expires <= time.monotonic():
+            del self._users[email]
+            return None
+        return user
+
+    def put(self, email: str, user: Dict) -> None:
+        self._users[email] = (user, time.monotonic() + self.ttl)
+        self._users.move_to_end(email)
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+
+class SessionTokens:
+    """Issues and verifies HMAC-signed session tokens carrying an email"""
+
+    def __init__(self, secret: bytes, ttl: float):
+        self.secret = secret
+        self.ttl = ttl
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, email: str) -> str:
+        claims = json.dumps({"email": email, "exp": int(time.time() + self.ttl)}, separators=(",", ":"))
+        payload = base64.urlsafe_b64encode(claims.encode()).decode().rstrip("=")
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[str]:
+        """The token's email, or None if it is malformed, forged or expired"""
+        payload, _, signature = token.partition(".")
+        if not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            return None
+        try:
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except ValueError:
+            return None
+        if claims.get("exp", 0) <= time.time():
+            return None
+        return claims.get("email")
+
+
+def session_email(request: Request) -> Optional[str]:
+    """The email of the request's verified session token, if it carries one"""
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not token:
+        return None
+    return request.app.state.sessions.verify(token)
+
+
+def build_recent_users() -> RecentUsers:
+    """Create the login cache, overridable via AUTH_CACHE_* env vars"""
+    return RecentUsers(
+        ttl=float(os.environ.get("AUTH_CACHE_TTL_S", "60")),
+        max_users=int(os.environ.get("AUTH_CACHE_MAX_USERS", "10000")),
+    )
+
+
+def build_sessions() -> SessionTokens:
+    """Create the session signer from SESSION_SECRET and SESSION_TTL_S"""
+    secret = os.environ.get("SESSION_SECRET")
+    if not secret:
+        # Tokens then only verify on the worker that issued them, until it restarts
+        logging.warning("SESSION_SECRET is not set; using a random per-process session secret")
+        secret = secrets.token_hex(32)
+    return SessionTokens(secret.encode(), ttl=float(os.environ.get("SESSION_TTL_S", str(30 * 24 * 3600))))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+FlySnipe in-process API benchmark
+Drives the ASGI app directly with the in-memory storage backend, so the
+numbers measure backend overhead (routing, validation, search generation,
+serialization) without network or MongoDB latency.
+
+Usage: python bench_backend.py [--requests N] [--concurrency C]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+# In-memory storage, and admission limits and quotas high enough not to shed the benchmark
+os.environ["STORAGE_BACKEND"] = "memory"
+for endpoint_class in ("SEARCH", "CHECKOUT"):
+    os.environ.setdefault(f"ADMISSION_{endpoint_class}_CONCURRENCY", "100000")
+    os.environ.setdefault(f"ADMISSION_{endpoint_class}_QUEUE", "100000")
+    os.environ.setdefault(f"ADMISSION_{endpoint_class}_RATE", "1000000000")
+    os.environ.setdefault(f"ADMISSION_{endpoint_class}_BURST", "1000000000")
+os.environ.setdefault("USAGE_QUOTA_FREE", "1000000000")
+os.environ.setdefault("USAGE_QUOTA_PREMIUM", "1000000000")
+# Per-request logs would dominate the output
+os.environ.setdefault("REQUEST_LOG_SAMPLE_RATE", "0")
+
+import httpx
+
+import server
+
+SCENARIOS = {
+    "health": ("GET", "/api/", None),
+    "search_free": ("POST", "/api/flights/search", {"from": "Geneva", "to": "Tokyo", "departureDate": "2025-02-15"}),
+    "search_premium": ("POST", "/api/flights/search", {"from": "New York", "to": "London", "departureDate": "2025-03-01", "passengers": 2, "premium": True}),
+    "search_compact": ("POST", "/api/flights/search?compact=true", {"from": "New York", "to": "London", "departureDate": "2025-03-01", "premium": True}),
+    "search_unrouted": ("POST", "/api/flights/search", {"from": "Springfield", "to": "Shelbyville", "departureDate": "2025-04-10", "premium": True}),
+    "google_auth": ("POST", "/api/auth/google", {"id_token": "bench"}),
+    "check_premium": ("GET", "/api/check-premium?email=user@example.com", None),
+}
+
+async def run_scenario(client, method, url, payload, total, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.request(method, url, json=payload)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url} returned {response.status_code}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FlySnipe API in process")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    app = server.create_app()
+    async with server.lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Seed the user the auth and premium scenarios read
+            await client.post("/api/auth/google", json={"id_token": "bench"})
+
+            print(f"{args.requests} requests per scenario, concurrency {args.concurrency}")
+            print(f"  {'scenario':<16} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+            for name, (method, url, payload) in SCENARIOS.items():
+                result = await run_scenario(client, method, url, payload, args.requests, args.concurrency)
+                print(f"  {name:<16} {result['rps']:>10.0f} {result['p50']:>8.2f} {result['p99']:>8.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+FlySnipe startup benchmark
+Measures how long a fresh worker takes to import server.py, build the app
+with create_app() and run its lifespan startup. Each run happens in a new
+interpreter so import caches do not hide the cost.
+
+Usage: python bench_startup.py [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+WORKER_SNIPPET = """
+import asyncio, json, time
+t0 = time.perf_counter()
+import server
+t1 = time.perf_counter()
+app = server.create_app()
+t2 = time.perf_counter()
+
+async def startup():
+    async with server.lifespan(app):
+        t3 = time.perf_counter()
+    return t3
+
+t3 = asyncio.run(startup())
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "lifespan": t3 - t2}))
+"""
+
+def run_once(env):
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER_SNIPPET],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FlySnipe worker startup")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # The lifespan only builds the client; no server has to be reachable
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "bench_database")
+
+    samples = [run_once(env) for _ in range(args.runs)]
+
+    print(f"Worker startup over {args.runs} runs (milliseconds)")
+    for phase in ("import", "create_app", "lifespan"):
+        values = [s[phase] * 1000 for s in samples]
+        print(f"  {phase:<12} median {statistics.median(values):8.2f}  max {max(values):8.2f}")
+
+if __name__ == "__main__":
+    main()
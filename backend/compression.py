@@ -0,0 +1,122 @@
+"""
+Response compression for the FlySnipe API.
+
+Negotiates brotli (when the optional ``brotli`` package is installed) or
+gzip from Accept-Encoding and compresses complete response bodies above a
+size threshold. Streaming responses are passed through untouched.
+"""
+
+import gzip
+from typing import Callable, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def _parse_accept_encoding(value: str) -> Dict[str, float]:
+    accepted = {}
+    for item in value.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders: Dict[str, Callable[[bytes], bytes]] = {
+            "gzip": lambda body: gzip.compress(body, compresslevel=gzip_level),
+        }
+        if brotli is not None:
+            self.encoders["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = _parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        for coding in ("br", "gzip"):
+            if coding in self.encoders and accepted.get(coding, wildcard) > 0:
+                return coding
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            coding = self.negotiate(Headers(scope=scope).get("Accept-Encoding", ""))
+            if coding:
+                responder = CompressionResponder(
+                    self.app, coding, self.encoders[coding], self.minimum_size
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(
+        self,
+        app: ASGIApp,
+        coding: str,
+        encode: Callable[[bytes], bytes],
+        minimum_size: int,
+    ) -> None:
+        self.app = app
+        self.coding = coding
+        self.encode = encode
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Hold the headers back until the first body chunk shows whether
+            # the response is worth compressing
+            self.initial_message = message
+            return
+
+        if message_type != "http.response.body" or self.started:
+            await self.send(message)
+            return
+
+        self.started = True
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        body = message.get("body", b"")
+        compressible = (
+            "content-encoding" not in headers
+            and not message.get("more_body", False)
+            and len(body) >= self.minimum_size
+        )
+        if compressible:
+            body = self.encode(body)
+            headers["Content-Encoding"] = self.coding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            message["body"] = body
+
+        await self.send(self.initial_message)
+        await self.send(message)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Chunked export of flight_searches and payment_transactions to CSV or Parquet.
+
+Documents are read from the storage cursor batch_size at a time in _id
+order, each batch becomes one pandas frame with a fixed column set and
+dtypes, and that frame is appended to the output before the next batch is
+read, so memory stays flat however large the collection is. Every row
+carries its export_id (the document _id) so an interrupted export can
+resume after the last row written.
+
+File exports keep a checkpoint next to the output: CSV files are
+truncated back to the last checkpointed batch on resume; Parquet exports
+are a directory of part files, and only completed parts are checkpointed.
+
+Usage: python export.py flight_searches --output searches.csv [--format csv|parquet]
+       [--start 2025-01-01] [--end 2025-02-01] [--batch-size 5000]
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException, Request
+
+from storage import Storage
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+# Exported columns and their dtypes; nullable dtypes keep the schema fixed
+# when documents lack a field
+EXPORTS: Dict[str, Dict[str, str]] = {
+    "flight_searches": {
+        "id": "string",
+        "from_city": "string",
+        "to_city": "string",
+        "departure_date": "string",
+        "passengers": "Int64",
+        "premium": "boolean",
+        "results_count": "Int64",
+        "timestamp": "datetime64[ns]",
+    },
+    "payment_transactions": {
+        "id": "string",
+        "email": "string",
+        "package_id": "string",
+        "amount": "Float64",
+        "currency": "string",
+        "session_id": "string",
+        "payment_status": "string",
+        "created_at": "datetime64[ns]",
+        "updated_at": "datetime64[ns]",
+    },
+}
+
+
+def to_frame(collection: str, batch: List[dict]) -> "pd.DataFrame":
+    """One batch of documents as a frame with the collection's columns and dtypes"""
+    # Imported on first export, so importing the server does not load pandas
+    import pandas as pd
+
+    dtypes = {"export_id": "string", **EXPORTS[collection]}
+    records = ({**doc, "export_id": str(doc["_id"])} for doc in batch)
+    return pd.DataFrame.from_records(records, columns=list(dtypes)).astype(dtypes)
+
+
+def batches(storage: Storage, collection: str, start: Optional[datetime], end: Optional[datetime], after: Optional[str], batch_size: int):
+    repository = {
+        "flight_searches": storage.flight_searches,
+        "payment_transactions": storage.payment_transactions,
+    }[collection]
+    return repository.batches(start, end, after, batch_size)
+
+
+class _Chunks:
+    """Write-only file object for the Parquet writer, drained after every batch"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+async def stream_export(storage: Storage, collection: str, fmt: str, start: Optional[datetime], end: Optional[datetime], after: Optional[str], batch_size: int) -> AsyncIterator[bytes]:
+    """The export as a byte stream, one CSV chunk or Parquet row group per batch"""
+    if fmt == "csv":
+        header = True
+        async for batch in batches(storage, collection, start, end, after, batch_size):
+            yield to_frame(collection, batch).to_csv(index=False, header=header).encode()
+            header = False
+        if header:
+            yield to_frame(collection, []).to_csv(index=False).encode()
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(to_frame(collection, []), preserve_index=False)
+    sink = _Chunks()
+    writer = pq.ParquetWriter(sink, schema)
+    async for batch in batches(storage, collection, start, end, after, batch_size):
+        writer.write_table(pa.Table.from_pandas(to_frame(collection, batch), schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def require_export_token(request: Request):
+    """FastAPI dependency: exports need EXPORT_API_TOKEN as a bearer token and are off without it"""
+    token = os.environ.get("EXPORT_API_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid export token")
+
+
+# File exports with checkpoints
+def _load_checkpoint(path: Path, job: dict) -> dict:
+    if path.exists():
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["job"] == job:
+            return checkpoint
+        raise SystemExit(f"{path} belongs to a different export; remove it or choose another output")
+    return {"job": job, "after": None, "rows": 0, "offset": 0, "parts": 0, "complete": False}
+
+
+def _save_checkpoint(path: Path, checkpoint: dict):
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+async def export_csv(storage: Storage, collection: str, start: Optional[datetime], end: Optional[datetime], output: Path, checkpoint_path: Path, checkpoint: dict, batch_size: int):
+    # Rows written after the last checkpoint are dropped and exported again
+    mode = "r+b" if checkpoint["offset"] else "wb"
+    with open(output, mode) as f:
+        f.truncate(checkpoint["offset"])
+        f.seek(checkpoint["offset"])
+        async for batch in batches(storage, collection, start, end, checkpoint["after"], batch_size):
+            f.write(to_frame(collection, batch).to_csv(index=False, header=f.tell() == 0).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            checkpoint.update(after=str(batch[-1]["_id"]), rows=checkpoint["rows"] + len(batch), offset=f.tell())
+            _save_checkpoint(checkpoint_path, checkpoint)
+        if f.tell() == 0:
+            f.write(to_frame(collection, []).to_csv(index=False).encode())
+            checkpoint["offset"] = f.tell()
+
+
+async def export_parquet(storage: Storage, collection: str, start: Optional[datetime], end: Optional[datetime], output: Path, checkpoint_path: Path, checkpoint: dict, batch_size: int, batches_per_part: int):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    output.mkdir(parents=True, exist_ok=True)
+    for unfinished in output.glob("*.parquet.tmp"):
+        unfinished.unlink()
+    schema = pa.Schema.from_pandas(to_frame(collection, []), preserve_index=False)
+
+    writer, part_path, part_batches, part_rows, after = None, None, 0, 0, checkpoint["after"]
+
+    def finish_part():
+        writer.close()
+        os.replace(part_path, part_path.with_suffix(""))
+        checkpoint.update(after=after, rows=checkpoint["rows"] + part_rows, parts=checkpoint["parts"] + 1)
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    async for batch in batches(storage, collection, start, end, checkpoint["after"], batch_size):
+        if writer is None:
+            part_path = output / f"part-{checkpoint['parts']:05d}.parquet.tmp"
+            writer = pq.ParquetWriter(part_path, schema)
+        writer.write_table(pa.Table.from_pandas(to_frame(collection, batch), schema=schema, preserve_index=False))
+        part_batches += 1
+        part_rows += len(batch)
+        after = str(batch[-1]["_id"])
+        if part_batches == batches_per_part:
+            finish_part()
+            writer, part_batches, part_rows = None, 0, 0
+    if writer is not None:
+        finish_part()
+
+
+async def export_to_file(storage: Storage, collection: str, fmt: str, output: Path, start: Optional[datetime], end: Optional[datetime], batch_size: int, batches_per_part: int) -> dict:
+    """Export to output (a file for CSV, a directory of parts for Parquet), resuming from its checkpoint"""
+    job = {
+        "collection": collection,
+        "format": fmt,
+        "start": start and start.isoformat(),
+        "end": end and end.isoformat(),
+    }
+    checkpoint_path = output.with_name(output.name + ".checkpoint.json")
+    checkpoint = _load_checkpoint(checkpoint_path, job)
+    if checkpoint["complete"]:
+        return checkpoint
+
+    if fmt == "csv":
+        await export_csv(storage, collection, start, end, output, checkpoint_path, checkpoint, batch_size)
+    else:
+        await export_parquet(storage, collection, start, end, output, checkpoint_path, checkpoint, batch_size, batches_per_part)
+    checkpoint["complete"] = True
+    _save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Export FlySnipe collections to CSV or Parquet")
+    parser.add_argument("collection", choices=sorted(EXPORTS))
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="inclusive, e.g. 2025-01-01")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="exclusive")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--batches-per-part", type=int, default=20, help="Parquet batches per part file")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from storage import create_storage
+
+    load_dotenv(Path(__file__).parent / ".env")
+    storage = create_storage()
+    try:
+        checkpoint = await export_to_file(
+            storage, args.collection, args.format, args.output,
+            args.start, args.end, args.batch_size, args.batches_per_part
+        )
+    finally:
+        storage.close()
+    print(f"Exported {checkpoint['rows']} {args.collection} rows to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Readiness probing for the FlySnipe API.
+
+The probe pings the storage backend at most once per cache window and
+shares that result between callers, so frequent health checks do not
+turn into database load. While the search cache is still warming up the
+server reports itself not ready yet.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from storage import Storage
+from warmup import CacheWarmer
+
+
+class ReadinessProbe:
+    """Pings storage at most once per cache window, sharing the result between callers"""
+
+    def __init__(self, storage: Storage, cache_ttl: float, warmer: Optional[CacheWarmer] = None):
+        self.storage = storage
+        self.cache_ttl = cache_ttl
+        self.warmer = warmer
+        self._lock = asyncio.Lock()
+        self._result: Optional[Dict] = None
+        self._checked_at = 0.0
+
+    async def check(self) -> Dict:
+        result = await self._ping()
+        if self.warmer is None:
+            return result
+        # Warmup progress is read live; only the ping is cached
+        warmup = self.warmer.status()
+        status = result["status"]
+        if status == "ready" and not warmup["ready"]:
+            status = "warming"
+        return {**result, "status": status, "warmup": warmup}
+
+    async def _ping(self) -> Dict:
+        if self._result is not None and time.monotonic() - self._checked_at < self.cache_ttl:
+            return {**self._result, "cached": True}
+
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if self._result is not None and time.monotonic() - self._checked_at < self.cache_ttl:
+                return {**self._result, "cached": True}
+
+            started = time.perf_counter()
+            try:
+                await self.storage.ping()
+                mongo = {"ok": True, "ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+            except Exception as e:
+                logging.error(f"Readiness ping failed: {str(e)}")
+                mongo = {"ok": False, "error": type(e).__name__}
+
+            self._result = {
+                "status": "ready" if mongo["ok"] else "unavailable",
+                "mongo": mongo,
+                "pool": self.storage.pool_stats(),
+            }
+            self._checked_at = time.monotonic()
+            return {**self._result, "cached": False}
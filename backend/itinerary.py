@@ -0,0 +1,47 @@
+"""
+k-best itinerary combination for round-trip and multi-city searches.
+
+Given one price-sorted flight list per leg, the cheapest combined
+itineraries are enumerated with a lazy best-first heap merge: every
+combination is a tuple of per-leg indices, and each popped tuple only
+pushes the few neighbours that can come next. Finding the k cheapest costs
+O(k * legs * log k) instead of pricing the full product of leg sizes.
+"""
+
+import heapq
+from typing import Callable, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def k_cheapest_combinations(
+    legs: Sequence[Sequence[T]],
+    k: int,
+    price: Callable[[T], int],
+) -> List[Tuple[int, List[T]]]:
+    """Return up to k (total_price, [option per leg]) pairs in ascending price order
+
+    Each leg must already be sorted by ascending price. A tuple's children
+    increment one index at or after its last non-zero position, which gives
+    every tuple exactly one parent, so no visited set is needed.
+    """
+    if k <= 0 or not legs or any(len(options) == 0 for options in legs):
+        return []
+
+    prices = [[price(option) for option in options] for options in legs]
+    start = (0,) * len(legs)
+    heap = [(sum(leg_prices[0] for leg_prices in prices), start, 0)]
+    results = []
+
+    while heap and len(results) < k:
+        total, indices, pivot = heapq.heappop(heap)
+        results.append((total, [legs[leg][i] for leg, i in enumerate(indices)]))
+
+        for leg in range(pivot, len(legs)):
+            i = indices[leg]
+            if i + 1 < len(prices[leg]):
+                child = indices[:leg] + (i + 1,) + indices[leg + 1:]
+                child_total = total - prices[leg][i] + prices[leg][i + 1]
+                heapq.heappush(heap, (child_total, child, leg))
+
+    return results
@@ -0,0 +1,248 @@
+"""
+Per-user search quotas, metered in memory.
+
+Every search that is admitted and served is counted against the caller's
+quota for the current window with a dict lookup, never a database round
+trip. Counts accumulate in a pending map and are flushed to the usage
+collection every few seconds as one bulk write of aggregated $inc upserts,
+so Mongo write volume follows the number of active users rather than the
+request rate. After each flush the worker reads the window's stored
+totals back with one find, so searches served by other workers count too
+and the quota holds across workers to within one flush interval.
+
+Callers are identified by their verified session token, or else by their
+IP address on the free tier. The quota tier comes from the stored user
+(is_premium), never from the client's `premium` flag; tiers are cached
+briefly per user.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+
+from admission import client_key
+from auth import session_email
+from storage import Storage
+
+
+class UsageMeter:
+    """Search counts per (user, window) for one worker, flushed to storage periodically"""
+
+    def __init__(
+        self,
+        storage: Storage,
+        window: int,
+        quotas: Dict[str, int],
+        flush_interval: float,
+        tier_ttl: float,
+        max_tiers: int = 10000,
+    ):
+        self.storage = storage
+        self.window = window
+        self.quotas = quotas
+        self.flush_interval = flush_interval
+        self.tier_ttl = tier_ttl
+        self.max_tiers = max_tiers
+
+        self._current = int(time.time() // window)
+        # Counts for the current window only: stored totals from every worker
+        # as of the last load, plus this worker's pending counts
+        self.counts: Dict[str, int] = {}
+        self.pending: Dict[Tuple[str, int], int] = {}
+        self._tiers: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_updates = 0
+
+    def _roll(self, now: float) -> int:
+        window = int(now // self.window)
+        if window != self._current:
+            # Earlier windows only live on in pending until the next flush
+            self._current = window
+            self.counts = {}
+        return window
+
+    def count(self, user: str, tier: str, now: Optional[float] = None) -> float:
+        """Count one search; return 0 if within quota, else seconds until the window resets"""
+        now = time.time() if now is None else now
+        window = self._roll(now)
+        used = self.counts.get(user, 0)
+        if used >= self.quotas[tier]:
+            self.rejected += 1
+            return (window + 1) * self.window - now
+        self.counts[user] = used + 1
+        key = (user, window)
+        self.pending[key] = self.pending.get(key, 0) + 1
+        return 0.0
+
+    def refund(self, user: str, now: float) -> None:
+        """Take back a search counted at `now` that was not served"""
+        window = int(now // self.window)
+        key = (user, window)
+        # May go negative when the count was flushed already; $inc applies it
+        self.pending[key] = self.pending.get(key, 0) - 1
+        if not self.pending[key]:
+            del self.pending[key]
+        if window == self._current and self.counts.get(user):
+            self.counts[user] -= 1
+
+    def usage(self, user: str, tier: str) -> Dict:
+        now = time.time()
+        window = self._roll(now)
+        used = self.counts.get(user, 0)
+        limit = self.quotas[tier]
+        return {
+            "tier": tier,
+            "used": used,
+            "limit": limit,
+            "remaining": max(0, limit - used),
+            "resets_in": math.ceil((window + 1) * self.window - now),
+        }
+
+    async def tier(self, user: str) -> str:
+        """'premium' for stored premium users, 'free' for everyone else including anonymous callers"""
+        if not user.startswith("email:"):
+            return "free"
+        cached = self._tiers.get(user)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        try:
+            stored = await self.storage.users.get(user.removeprefix("email:"), fields=["is_premium"])
+        except Exception as e:
+            logging.error(f"Usage tier lookup error: {str(e)}")
+            return "free"
+        tier = "premium" if stored and stored.get("is_premium") else "free"
+        self._tiers[user] = (tier, time.monotonic() + self.tier_ttl)
+        self._tiers.move_to_end(user)
+        if len(self._tiers) > self.max_tiers:
+            self._tiers.popitem(last=False)
+        return tier
+
+    async def load(self) -> None:
+        """Replace the current window's counts with the stored totals of every worker"""
+        window = self._roll(time.time())
+        stored = await self.storage.usage.load(window)
+        if window != self._current:
+            return
+        # Searches counted since the last flush are not stored yet
+        counts = dict(stored)
+        for (user, key_window), count in self.pending.items():
+            if key_window == window:
+                counts[user] = counts.get(user, 0) + count
+        self.counts = counts
+
+    async def flush(self, reload: bool = True) -> None:
+        """Write pending counts, then read back the window's totals across workers
+        unless reload is false (at shutdown, where only the writes matter)"""
+        if self.pending:
+            pending, self.pending = self.pending, {}
+            try:
+                # Kept one extra window so restarts near a window boundary still reload it
+                expires_at = datetime.utcnow() + timedelta(seconds=2 * self.window)
+                await self.storage.usage.add(pending, expires_at)
+            except Exception as e:
+                logging.error(f"Usage flush error: {str(e)}")
+                for key, count in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + count
+                return
+            self.flushes += 1
+            self.flushed_updates += len(pending)
+        if not reload:
+            return
+        try:
+            await self.load()
+        except Exception as e:
+            logging.error(f"Usage reload error: {str(e)}")
+
+    async def run(self) -> None:
+        """Reload stored counts, then flush every flush_interval seconds"""
+        try:
+            await self.load()
+        except Exception as e:
+            logging.error(f"Usage reload error: {str(e)}")
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def metrics(self) -> Dict:
+        return {
+            "window_seconds": self.window,
+            "quotas": self.quotas,
+            "users": len(self.counts),
+            "pending_updates": len(self.pending),
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_updates": self.flushed_updates,
+        }
+
+
+def build_meter(storage: Storage) -> UsageMeter:
+    """Create the meter, overridable via USAGE_* env vars"""
+    return UsageMeter(
+        storage,
+        window=int(os.environ.get("USAGE_WINDOW_S", "3600")),
+        quotas={
+            "free": int(os.environ.get("USAGE_QUOTA_FREE", "100")),
+            "premium": int(os.environ.get("USAGE_QUOTA_PREMIUM", "2000")),
+        },
+        flush_interval=float(os.environ.get("USAGE_FLUSH_INTERVAL_S", "10")),
+        tier_ttl=float(os.environ.get("USAGE_TIER_TTL_S", "60")),
+    )
+
+
+def usage_identity(request: Request) -> str:
+    """The signed-in user of a verified session token, else the caller's IP address"""
+    email = session_email(request)
+    return f"email:{email}" if email else client_key(request)
+
+
+async def meter_search(request: Request):
+    """FastAPI dependency counting a search against the caller's quota
+
+    List it after admission_guard so shed requests are never counted. The
+    search is counted up front, so concurrent requests cannot overrun the
+    quota, and refunded if the request then fails (invalid body or fields,
+    server error). FastAPI reports invalid parameters only after
+    dependencies exit, so those are refunded by refund_invalid_search.
+    """
+    meter: UsageMeter = request.app.state.usage
+    user = usage_identity(request)
+    now = time.time()
+    retry_after = meter.count(user, await meter.tier(user), now)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Search quota exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+    request.state.search_charge = (user, now)
+    try:
+        yield
+    except BaseException:
+        refund_search(request)
+        raise
+
+
+def refund_search(request: Request) -> None:
+    """Refund the search meter_search counted for this request, if it has not been already"""
+    charge = getattr(request.state, "search_charge", None)
+    if charge is not None:
+        del request.state.search_charge
+        request.app.state.usage.refund(*charge)
+
+
+async def refund_invalid_search(request: Request, exc: RequestValidationError):
+    """RequestValidationError handler: refund the search, then answer the usual 422"""
+    refund_search(request)
+    return await request_validation_exception_handler(request, exc)
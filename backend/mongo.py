@@ -0,0 +1,107 @@
+"""
+MongoDB client construction.
+
+Pool sizing, timeouts and wire compression come from MONGO_* environment
+variables, and a pool listener keeps live checked-out / available /
+waiting counts for the readiness probe.
+"""
+
+import os
+import threading
+from typing import Dict, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+# Environment variable -> MongoClient option, for integer settings
+POOL_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_MAX_CONNECTING": "maxConnecting",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+
+
+def mongo_client_options() -> Dict:
+    """Client keyword arguments for every MONGO_* setting present in the environment"""
+    options = {
+        option: int(os.environ[env])
+        for env, option in POOL_OPTIONS.items()
+        if os.environ.get(env)
+    }
+    # e.g. "zstd,snappy,zlib"; zstd and snappy need their optional packages
+    compressors = os.environ.get("MONGO_COMPRESSORS")
+    if compressors:
+        options["compressors"] = compressors
+        if os.environ.get("MONGO_ZLIB_LEVEL"):
+            options["zlibCompressionLevel"] = int(os.environ["MONGO_ZLIB_LEVEL"])
+    return options
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Live connection pool counters; events arrive from driver threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+
+    def _add(self, open_delta=0, checked_out_delta=0, waiting_delta=0):
+        with self._lock:
+            self.open += open_delta
+            self.checked_out += checked_out_delta
+            self.waiting += waiting_delta
+
+    def connection_created(self, event):
+        self._add(open_delta=1)
+
+    def connection_closed(self, event):
+        self._add(open_delta=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting_delta=1)
+
+    def connection_checked_out(self, event):
+        self._add(checked_out_delta=1, waiting_delta=-1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting_delta=-1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out_delta=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "available": max(0, self.open - self.checked_out),
+                "wait_queue_length": self.waiting,
+            }
+
+
+def create_mongo_client(mongo_url: str) -> Tuple[AsyncIOMotorClient, PoolStats]:
+    pool_stats = PoolStats()
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_stats], **mongo_client_options())
+    return client, pool_stats
+
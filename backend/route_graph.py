@@ -0,0 +1,284 @@
+"""
+In-memory airline network for realistic connecting itineraries.
+
+The network (airports, carriers, scheduled legs and minimum connection
+times) is loaded once from ``data/route_network.json`` and its adjacency
+lists are built up front. Connecting routes are enumerated with Yen's
+k-shortest loopless paths over Dijkstra, then scheduled against the legs'
+daily departure times so every connection respects the airport's minimum
+connection time.
+"""
+
+import heapq
+import json
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+NETWORK_PATH = Path(__file__).parent / "data" / "route_network.json"
+
+# Connections waiting longer than this are not offered
+MAX_LAYOVER_MINUTES = 12 * 60
+
+# Cell size of the airport coordinate grid, in degrees
+GRID_DEGREES = 1.0
+EARTH_RADIUS_KM = 6371.0
+
+
+@dataclass(frozen=True)
+class AirportInfo:
+    code: str
+    name: str
+    city: str
+    lat: float
+    lon: float
+    mct: int  # minimum connection time in minutes
+
+
+@dataclass(frozen=True)
+class Leg:
+    index: int
+    carrier: str
+    flight_number: str
+    origin: str
+    destination: str
+    duration: int
+    price: int
+    aircraft: str
+    departures: Tuple[int, ...]  # minutes after midnight, ascending
+
+
+@dataclass
+class ScheduledSegment:
+    leg: Leg
+    departure: datetime
+    arrival: datetime
+
+
+@dataclass
+class ScheduledItinerary:
+    segments: List[ScheduledSegment]
+    layovers: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def base_price(self) -> int:
+        return sum(segment.leg.price for segment in self.segments)
+
+    @property
+    def duration_minutes(self) -> int:
+        elapsed = self.segments[-1].arrival - self.segments[0].departure
+        return int(elapsed.total_seconds() // 60)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def _grid_cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES)
+
+
+def _parse_minutes(value: str) -> int:
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class RouteNetwork:
+    def __init__(self, airports: List[AirportInfo], carriers: Dict[str, str], legs: List[Leg]):
+        self.airports = {airport.code: airport for airport in airports}
+        self.carriers = carriers
+        self.legs = legs
+
+        # Precomputed lookups so searches never scan the whole leg list
+        self.adjacency: Dict[str, List[Leg]] = {code: [] for code in self.airports}
+        for leg in legs:
+            self.adjacency[leg.origin].append(leg)
+        self.city_index: Dict[str, List[str]] = {}
+        for airport in airports:
+            self.city_index.setdefault(airport.city.lower(), []).append(airport.code)
+        # Coordinate grid so radius queries only look at nearby cells
+        self.grid: Dict[Tuple[int, int], List[AirportInfo]] = {}
+        for airport in airports:
+            self.grid.setdefault(_grid_cell(airport.lat, airport.lon), []).append(airport)
+        # Per instance, so the cache neither outlives nor mixes networks
+        self._k_shortest_paths = lru_cache(maxsize=4096)(self._find_k_shortest_paths)
+
+    @classmethod
+    def load(cls, path: Path = NETWORK_PATH) -> "RouteNetwork":
+        with open(path) as f:
+            data = json.load(f)
+        airports = [AirportInfo(**airport) for airport in data["airports"]]
+        carriers = {carrier["code"]: carrier["name"] for carrier in data["carriers"]}
+        legs = [
+            Leg(
+                index=i,
+                carrier=leg["carrier"],
+                flight_number=leg["flight_number"],
+                origin=leg["from"],
+                destination=leg["to"],
+                duration=leg["duration"],
+                price=leg["price"],
+                aircraft=leg["aircraft"],
+                departures=tuple(sorted(_parse_minutes(d) for d in leg["departures"])),
+            )
+            for i, leg in enumerate(data["legs"])
+        ]
+        return cls(airports, carriers, legs)
+
+    def resolve(self, name: str) -> List[str]:
+        """Map an IATA code or city name to the airport codes it covers"""
+        code = name.strip().upper()
+        if code in self.airports:
+            return [code]
+        return list(self.city_index.get(name.strip().lower(), []))
+
+    def nearby(self, code: str, radius_km: float) -> List[str]:
+        """Airports within radius_km of the given airport, closest first (itself included)"""
+        center = self.airports[code]
+        lat_cells = math.ceil(radius_km / 111.0 / GRID_DEGREES)
+        # Longitude degrees shrink towards the poles; clamp near them
+        lon_span = radius_km / (111.0 * max(math.cos(math.radians(center.lat)), 0.01))
+        lon_cells = min(math.ceil(lon_span / GRID_DEGREES), int(360 / GRID_DEGREES))
+        center_lat, center_lon = _grid_cell(center.lat, center.lon)
+
+        found = []
+        for lat_cell in range(center_lat - lat_cells, center_lat + lat_cells + 1):
+            for lon_cell in range(center_lon - lon_cells, center_lon + lon_cells + 1):
+                # Wrap around the antimeridian
+                wrapped = (lon_cell + 180) % int(360 / GRID_DEGREES) - 180
+                for airport in self.grid.get((lat_cell, wrapped), ()):
+                    distance = haversine_km(center.lat, center.lon, airport.lat, airport.lon)
+                    if distance <= radius_km:
+                        found.append((distance, airport.code))
+        return [code for _, code in sorted(set(found))]
+
+    def _leg_cost(self, leg: Leg, weight: str) -> int:
+        if weight == "price":
+            return leg.price
+        # Duration paths count the connection time needed at the arrival airport
+        return leg.duration + self.airports[leg.destination].mct
+
+    def _dijkstra(
+        self,
+        source: str,
+        target: str,
+        weight: str,
+        banned_legs: FrozenSet[int] = frozenset(),
+        banned_airports: FrozenSet[str] = frozenset(),
+    ) -> Optional[Tuple[int, List[Leg]]]:
+        dist = {source: 0}
+        previous: Dict[str, Leg] = {}
+        heap = [(0, source)]
+        while heap:
+            cost, airport = heapq.heappop(heap)
+            if airport == target:
+                path = []
+                while airport != source:
+                    leg = previous[airport]
+                    path.append(leg)
+                    airport = leg.origin
+                path.reverse()
+                return cost, path
+            if cost > dist[airport]:
+                continue
+            for leg in self.adjacency[airport]:
+                nxt = leg.destination
+                if leg.index in banned_legs or nxt in banned_airports:
+                    continue
+                new_cost = cost + self._leg_cost(leg, weight)
+                if new_cost < dist.get(nxt, new_cost + 1):
+                    dist[nxt] = new_cost
+                    previous[nxt] = leg
+                    heapq.heappush(heap, (new_cost, nxt))
+        return None
+
+    def k_shortest_paths(
+        self, origin: str, destination: str, k: int, weight: str = "price", max_stops: int = 2
+    ) -> List[Tuple[Leg, ...]]:
+        """Yen's algorithm: up to k loopless leg sequences in ascending cost"""
+        return list(self._k_shortest_paths(origin, destination, k, weight, max_stops))
+
+    def _find_k_shortest_paths(
+        self, origin: str, destination: str, k: int, weight: str, max_stops: int
+    ) -> Tuple[Tuple[Leg, ...], ...]:
+        if origin == destination or origin not in self.airports or destination not in self.airports:
+            return ()
+        first = self._dijkstra(origin, destination, weight)
+        if first is None:
+            return ()
+
+        found: List[Tuple[int, Tuple[Leg, ...]]] = [(first[0], tuple(first[1]))]
+        candidates: List[Tuple[int, Tuple[int, ...], Tuple[Leg, ...]]] = []
+        seen = {tuple(leg.index for leg in first[1])}
+        # Paths exceeding max_stops still seed spur searches but are not returned
+        results = [path for _, path in found if len(path) - 1 <= max_stops]
+
+        # Bound the search when most short paths exceed max_stops
+        while len(results) < k and len(found) < k * 4:
+            _, last_path = found[-1]
+            for i in range(len(last_path)):
+                spur_airport = last_path[i].origin
+                root = last_path[:i]
+                banned_legs = frozenset(
+                    path[i].index for _, path in found if len(path) > i and path[:i] == root
+                )
+                banned_airports = frozenset(leg.origin for leg in root)
+                spur = self._dijkstra(spur_airport, destination, weight, banned_legs, banned_airports)
+                if spur is None:
+                    continue
+                path = root + tuple(spur[1])
+                key = tuple(leg.index for leg in path)
+                if key in seen:
+                    continue
+                seen.add(key)
+                cost = sum(self._leg_cost(leg, weight) for leg in path)
+                heapq.heappush(candidates, (cost, key, path))
+
+            if not candidates:
+                break
+            cost, _, path = heapq.heappop(candidates)
+            found.append((cost, path))
+            if len(path) - 1 <= max_stops:
+                results.append(path)
+
+        return tuple(results)
+
+    def schedule(self, path: Tuple[Leg, ...], date: datetime) -> List[ScheduledItinerary]:
+        """Every itinerary along path departing on date, one per first-leg departure"""
+        itineraries = []
+        for first_departure in path[0].departures:
+            departure = date + timedelta(minutes=first_departure)
+            segments = [ScheduledSegment(path[0], departure, departure + timedelta(minutes=path[0].duration))]
+            layovers = []
+            for leg in path[1:]:
+                arrival = segments[-1].arrival
+                ready = arrival + timedelta(minutes=self.airports[leg.origin].mct)
+                departure = self._next_departure(leg, ready)
+                layover = int((departure - arrival).total_seconds() // 60)
+                if layover > MAX_LAYOVER_MINUTES:
+                    break
+                layovers.append((leg.origin, layover))
+                segments.append(ScheduledSegment(leg, departure, departure + timedelta(minutes=leg.duration)))
+            else:
+                itineraries.append(ScheduledItinerary(segments, layovers))
+        return itineraries
+
+    @staticmethod
+    def _next_departure(leg: Leg, ready: datetime) -> datetime:
+        midnight = ready.replace(hour=0, minute=0, second=0, microsecond=0)
+        ready_minutes = ready.hour * 60 + ready.minute
+        for minutes in leg.departures:
+            if minutes >= ready_minutes:
+                return midnight + timedelta(minutes=minutes)
+        return midnight + timedelta(days=1, minutes=leg.departures[0])
+
+
+@lru_cache(maxsize=None)
+def default_network() -> RouteNetwork:
+    """The bundled network, loaded once per worker"""
+    return RouteNetwork.load()
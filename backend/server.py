@@ -1,35 +1,64 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
+import time
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, TYPE_CHECKING
 import uuid
+from bson import ObjectId
 from datetime import datetime, timedelta
 import random
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+import asyncio
+import functools
+import heapq
+from itertools import islice
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+from admission import admission_guard, build_gates
+from auth import build_recent_users, build_sessions
+from compression import CompressionMiddleware
+from export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, EXPORTS, require_export_token, stream_export
+from itinerary import k_cheapest_combinations
+from metering import build_meter, meter_search, refund_invalid_search, usage_identity
+from health import ReadinessProbe
+from route_graph import RouteNetwork, default_network
+from storage import Storage, create_storage
+from timing import TimedRoute, TimingMiddleware, phase, record_error, request_log, timed
+from warmup import SearchCache, build_warmer
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+if TYPE_CHECKING:
+    from emergentintegrations.payments.stripe.checkout import StripeCheckout
 
-# Create the main app without a prefix
-app = FastAPI(title="FlySnipe API", version="1.0.0")
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
 
-# Initialize Stripe checkout
+# Stripe checkout is created lazily per worker, on the first payment request
 stripe_api_key = os.environ.get('STRIPE_API_KEY')
-if stripe_api_key:
-    stripe_checkout = None  # Will be initialized when needed
+
+# Connecting routes considered per origin/destination airport pair
+NETWORK_PATHS_PER_PAIR = 6
+
+# Multi-city searches are limited to this many legs
+MAX_ITINERARY_LEGS = 6
+
+# Multi-airport searches cover at most this many airports on each side,
+# nearest first, and look this far for nearby airports
+MAX_SEARCH_AIRPORTS = 5
+MAX_NEARBY_KM = 300
+
+# Search results are stable for a given query within one version window,
+# so clients can revalidate them with ETags instead of downloading again
+SEARCH_RESULT_TTL = int(os.environ.get('SEARCH_RESULT_TTL', '300'))
 
 # Payment packages
 PREMIUM_PACKAGES = {
@@ -46,12 +75,68 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+def check_date(value: Optional[str]) -> Optional[str]:
+    """Reject dates that are not calendar dates in YYYY-MM-DD form"""
+    if value is not None:
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("must be a date in YYYY-MM-DD format")
+    return value
+
 class FlightSearchRequest(BaseModel):
     from_city: str = Field(..., alias="from")
     to_city: str = Field(..., alias="to")
     departure_date: str = Field(..., alias="departureDate")
     passengers: int = 1
     premium: bool = False
+    # Extra airport codes or cities searched alongside from/to, and a radius
+    # that adds every airport within it
+    origins: List[str] = Field(default_factory=list, max_length=MAX_SEARCH_AIRPORTS)
+    destinations: List[str] = Field(default_factory=list, max_length=MAX_SEARCH_AIRPORTS)
+    nearby_km: Optional[float] = Field(None, alias="nearbyKm", gt=0, le=MAX_NEARBY_KM)
+
+    _check_departure_date = field_validator("departure_date")(check_date)
+
+    @property
+    def multi_airport(self) -> bool:
+        return bool(self.origins or self.destinations or self.nearby_km)
+
+class ItineraryLeg(BaseModel):
+    from_city: str = Field(..., alias="from")
+    to_city: str = Field(..., alias="to")
+    departure_date: str = Field(..., alias="departureDate")
+
+    _check_departure_date = field_validator("departure_date")(check_date)
+
+class ItinerarySearchRequest(BaseModel):
+    """Round trip (from/to/departureDate/returnDate) or multi-city (legs)"""
+    from_city: Optional[str] = Field(None, alias="from")
+    to_city: Optional[str] = Field(None, alias="to")
+    departure_date: Optional[str] = Field(None, alias="departureDate")
+    return_date: Optional[str] = Field(None, alias="returnDate")
+    legs: Optional[List[ItineraryLeg]] = None
+    passengers: int = 1
+    premium: bool = False
+    k: int = Field(10, ge=1, le=50)
+
+    _check_dates = field_validator("departure_date", "return_date")(check_date)
+
+    @model_validator(mode="after")
+    def resolve_legs(self):
+        if not self.legs:
+            if not (self.from_city and self.to_city and self.departure_date and self.return_date):
+                raise ValueError("Provide legs, or from, to, departureDate and returnDate")
+            self.legs = [
+                ItineraryLeg(**{"from": self.from_city, "to": self.to_city, "departureDate": self.departure_date}),
+                ItineraryLeg(**{"from": self.to_city, "to": self.from_city, "departureDate": self.return_date}),
+            ]
+        if len(self.legs) > MAX_ITINERARY_LEGS:
+            raise ValueError(f"At most {MAX_ITINERARY_LEGS} legs are supported")
+        dates = [leg.departure_date for leg in self.legs]
+        if dates != sorted(dates):
+            raise ValueError("Leg departure dates must be in chronological order")
+        return self
 
 class Airport(BaseModel):
     code: str
@@ -73,6 +158,8 @@ class Flight(BaseModel):
     stops: int
     baggage: Optional[str] = None
     booking_url: Optional[str] = None
+    layovers: Optional[List[dict]] = None
+    segments: Optional[List[dict]] = None
 
 class FlightSearchResponse(BaseModel):
     flights: List[Flight]
@@ -80,6 +167,18 @@ class FlightSearchResponse(BaseModel):
     search_params: dict
     premium_features_used: bool = False
 
+class Itinerary(BaseModel):
+    legs: List[Flight]
+    total_price: int
+    total_duration_minutes: int
+    currency: str = "USD"
+
+class ItinerarySearchResponse(BaseModel):
+    itineraries: List[Itinerary]
+    total_results: int
+    search_params: dict
+    premium_features_used: bool = False
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     email: str
@@ -107,8 +206,130 @@ class CheckoutRequest(BaseModel):
     package_id: str
     email: Optional[str] = None
 
+# Flight fields that can be requested one by one; "departure.time" style
+# names select a single part of the departure or arrival object
+FLIGHT_FIELDS = (
+    "id", "airline", "flight_number", "aircraft", "departure", "arrival", "duration",
+    "duration_minutes", "price", "currency", "class", "stops", "baggage", "booking_url",
+    "layovers", "segments"
+)
+ENDPOINT_PARTS = ("airport", "city", "time")
+SELECTABLE_FIELDS = frozenset(FLIGHT_FIELDS) | {
+    f"{endpoint}.{part}" for endpoint in ("departure", "arrival") for part in ENDPOINT_PARTS
+}
+ALL_FLIGHT_FIELDS = frozenset(FLIGHT_FIELDS)
+
+# What popup.js and flysnipe.js render for each flight
+COMPACT_DEFAULT_FIELDS = (
+    "airline", "flight_number", "aircraft", "price", "class", "departure.airport", "departure.time",
+    "arrival.airport", "arrival.time", "duration", "stops", "baggage"
+)
+
+def endpoint_parts(fields: FrozenSet[str], endpoint: str) -> Tuple[str, ...]:
+    """Parts of the departure/arrival object that the requested fields need"""
+    if endpoint in fields:
+        return ENDPOINT_PARTS
+    return tuple(part for part in ENDPOINT_PARTS if f"{endpoint}.{part}" in fields)
+
+def flight_endpoint(parts: Tuple[str, ...], airport: str, city: str, time: Callable[[], str]) -> dict:
+    endpoint = {}
+    for part in parts:
+        endpoint[part] = airport if part == "airport" else city if part == "city" else time()
+    return endpoint
+
+# Flight generation from the bundled route network
+def network_flight_rows(network: RouteNetwork, origins: List[str], destinations: List[str], departure_date: str, premium: bool, rng: random.Random, fields: FrozenSet[str]) -> List[dict]:
+    date = datetime.strptime(departure_date, "%Y-%m-%d")
+    candidates = []
+    for origin in origins:
+        for destination in destinations:
+            for path in network.k_shortest_paths(origin, destination, NETWORK_PATHS_PER_PAIR):
+                candidates.extend(network.schedule(path, date))
+
+    # Fares vary around the route's base price from one departure to the next
+    priced = [(int(itinerary.base_price * rng.uniform(0.85, 1.25)), itinerary) for itinerary in candidates]
+    priced.sort(key=lambda item: (item[0], item[1].duration_minutes))
+
+    num_flights = rng.randint(8, 15) if premium else 3
+    # Draw every random value before building anything, so a flight is the
+    # same whichever subset of its fields is requested
+    draws = [
+        (
+            price,
+            itinerary,
+            rng.choice(["Economy", "Premium Economy", "Business", "First Class"]),
+            rng.choice([True, False]),
+            rng.getrandbits(128),
+            rng.getrandbits(128)
+        )
+        for price, itinerary in priced[:num_flights]
+    ]
+
+    departure_parts = endpoint_parts(fields, "departure")
+    arrival_parts = endpoint_parts(fields, "arrival")
+    rows = []
+    for price, itinerary, class_type, baggage, id_bits, booking_bits in draws:
+        first, last = itinerary.segments[0], itinerary.segments[-1]
+        row = {}
+        if "id" in fields:
+            row["id"] = str(uuid.UUID(int=id_bits, version=4))
+        if "airline" in fields:
+            row["airline"] = first.leg.carrier
+        if "flight_number" in fields:
+            row["flight_number"] = first.leg.flight_number
+        if "aircraft" in fields:
+            row["aircraft"] = first.leg.aircraft
+        if departure_parts:
+            origin = network.airports[first.leg.origin]
+            row["departure"] = flight_endpoint(
+                departure_parts, origin.code, origin.city, lambda: first.departure.strftime("%H:%M")
+            )
+        if arrival_parts:
+            destination = network.airports[last.leg.destination]
+            row["arrival"] = flight_endpoint(
+                arrival_parts, destination.code, destination.city, lambda: last.arrival.strftime("%H:%M")
+            )
+        if "duration" in fields:
+            duration_minutes = itinerary.duration_minutes
+            row["duration"] = f"{duration_minutes // 60}h {duration_minutes % 60}m"
+        if "duration_minutes" in fields:
+            row["duration_minutes"] = itinerary.duration_minutes
+        if "price" in fields:
+            row["price"] = price
+        if "currency" in fields:
+            row["currency"] = "USD"
+        if "class" in fields:
+            row["class"] = class_type
+        if "stops" in fields:
+            row["stops"] = len(itinerary.segments) - 1
+        if "baggage" in fields:
+            row["baggage"] = "1 checked bag included" if baggage else None
+        if "booking_url" in fields:
+            row["booking_url"] = f"https://www.example-airline.com/book/{uuid.UUID(int=booking_bits, version=4)}"
+        if "layovers" in fields:
+            row["layovers"] = [
+                {"airport": code, "city": network.airports[code].city, "minutes": minutes}
+                for code, minutes in itinerary.layovers
+            ]
+        if "segments" in fields:
+            row["segments"] = [
+                {
+                    "airline": segment.leg.carrier,
+                    "flight_number": segment.leg.flight_number,
+                    "aircraft": segment.leg.aircraft,
+                    "from": segment.leg.origin,
+                    "to": segment.leg.destination,
+                    "departure": segment.departure.strftime("%Y-%m-%dT%H:%M"),
+                    "arrival": segment.arrival.strftime("%Y-%m-%dT%H:%M"),
+                    "duration_minutes": segment.leg.duration
+                }
+                for segment in itinerary.segments
+            ]
+        rows.append(row)
+    return rows
+
 # Mock flight data generator
-def generate_mock_flights(from_city: str, to_city: str, departure_date: str, premium: bool = False) -> List[Flight]:
+def mock_flight_rows(from_city: str, to_city: str, premium: bool, rng: random.Random, fields: FrozenSet[str]) -> List[dict]:
     airlines = [
         {"code": "AA", "name": "American Airlines"},
         {"code": "DL", "name": "Delta Airlines"},
@@ -127,96 +348,581 @@ def generate_mock_flights(from_city: str, to_city: str, departure_date: str, pre
     from_code = from_city[:3].upper()
     to_code = to_city[:3].upper()
     
-    flights = []
-    num_flights = random.randint(8, 15) if premium else 3
+    num_flights = rng.randint(8, 15) if premium else 3
     
-    for i in range(num_flights):
-        airline = random.choice(airlines)
-        base_price = random.randint(300, 2000)
-        departure_hour = random.randint(6, 22)
-        duration_minutes = random.randint(120, 720)  # 2-12 hours
-        
-        arrival_time = datetime.strptime(departure_date, "%Y-%m-%d").replace(
-            hour=departure_hour, minute=random.randint(0, 59)
-        ) + timedelta(minutes=duration_minutes)
-        
-        flight_data = {
-            "airline": airline["code"],
-            "flight_number": f"{airline['code']}{random.randint(100, 9999)}",
-            "aircraft": random.choice(aircraft_types),
-            "departure": {
-                "airport": f"{from_code}",
-                "city": from_city,
-                "time": f"{departure_hour:02d}:{random.randint(0, 59):02d}"
-            },
-            "arrival": {
-                "airport": f"{to_code}",
-                "city": to_city,
-                "time": f"{arrival_time.hour:02d}:{arrival_time.minute:02d}"
-            },
-            "duration": f"{duration_minutes // 60}h {duration_minutes % 60}m",
-            "duration_minutes": duration_minutes,
-            "price": base_price,
-            "class": random.choice(class_types),
-            "stops": random.choice([0, 0, 0, 1, 1, 2]),  # Mostly direct flights
-            "baggage": "1 checked bag included" if random.choice([True, False]) else None,
-            "booking_url": f"https://www.example-airline.com/book/{uuid.uuid4()}"
-        }
-        flight = Flight(**flight_data)
-        flights.append(flight)
+    # Draw every random value before building anything, so a flight is the
+    # same whichever subset of its fields is requested
+    draws = [
+        (
+            rng.randint(300, 2000),
+            rng.choice(airlines)["code"],
+            rng.randint(100, 9999),
+            rng.choice(aircraft_types),
+            rng.randint(6, 22) * 60 + rng.randint(0, 59),
+            rng.randint(120, 720),  # 2-12 hours
+            rng.choice(class_types),
+            rng.choice([0, 0, 0, 1, 1, 2]),  # Mostly direct flights
+            rng.choice([True, False]),
+            rng.getrandbits(128),
+            rng.getrandbits(128)
+        )
+        for i in range(num_flights)
+    ]
     
     # Sort by price by default
-    flights.sort(key=lambda x: x.price)
-    return flights
+    draws.sort(key=lambda draw: draw[0])
+    
+    departure_parts = endpoint_parts(fields, "departure")
+    arrival_parts = endpoint_parts(fields, "arrival")
+    rows = []
+    for price, airline, number, aircraft, departure, duration_minutes, class_type, stops, baggage, id_bits, booking_bits in draws:
+        row = {}
+        if "id" in fields:
+            row["id"] = str(uuid.UUID(int=id_bits, version=4))
+        if "airline" in fields:
+            row["airline"] = airline
+        if "flight_number" in fields:
+            row["flight_number"] = f"{airline}{number}"
+        if "aircraft" in fields:
+            row["aircraft"] = aircraft
+        if departure_parts:
+            row["departure"] = flight_endpoint(
+                departure_parts, from_code, from_city, lambda: f"{departure // 60:02d}:{departure % 60:02d}"
+            )
+        if arrival_parts:
+            arrival = (departure + duration_minutes) % (24 * 60)
+            row["arrival"] = flight_endpoint(
+                arrival_parts, to_code, to_city, lambda: f"{arrival // 60:02d}:{arrival % 60:02d}"
+            )
+        if "duration" in fields:
+            row["duration"] = f"{duration_minutes // 60}h {duration_minutes % 60}m"
+        if "duration_minutes" in fields:
+            row["duration_minutes"] = duration_minutes
+        if "price" in fields:
+            row["price"] = price
+        if "currency" in fields:
+            row["currency"] = "USD"
+        if "class" in fields:
+            row["class"] = class_type
+        if "stops" in fields:
+            row["stops"] = stops
+        if "baggage" in fields:
+            row["baggage"] = "1 checked bag included" if baggage else None
+        if "booking_url" in fields:
+            row["booking_url"] = f"https://www.example-airline.com/book/{uuid.UUID(int=booking_bits, version=4)}"
+        # Mock flights carry no connection details, as on Flight when unset
+        if "layovers" in fields:
+            row["layovers"] = None
+        if "segments" in fields:
+            row["segments"] = None
+        rows.append(row)
+    return rows
+
+@timed("generate")
+def generate_flight_rows(from_city: str, to_city: str, departure_date: str, premium: bool = False, rng: Optional[random.Random] = None, fields: FrozenSet[str] = ALL_FLIGHT_FIELDS) -> List[dict]:
+    """Price-sorted flights as plain dicts holding only the requested fields"""
+    rng = rng or random.Random()
+
+    # Cities served by the route network get real connections and layovers
+    network = default_network()
+    origins, destinations = network.resolve(from_city), network.resolve(to_city)
+    if origins and destinations:
+        rows = network_flight_rows(network, origins, destinations, departure_date, premium, rng, fields)
+        if rows:
+            return rows
+    return mock_flight_rows(from_city, to_city, premium, rng, fields)
+
+def generate_mock_flights(from_city: str, to_city: str, departure_date: str, premium: bool = False, rng: Optional[random.Random] = None) -> List[Flight]:
+    return [Flight(**row) for row in generate_flight_rows(from_city, to_city, departure_date, premium, rng)]
+
+# Search helpers
+def search_result_version(now: float) -> int:
+    return int(now // SEARCH_RESULT_TTL)
+
+def search_fingerprint(request: FlightSearchRequest, version: int) -> str:
+    """Hash of everything that shapes a search response, used as seed and ETag"""
+    key = json.dumps([
+        request.from_city,
+        request.to_city,
+        request.departure_date,
+        request.passengers,
+        request.premium,
+        request.origins,
+        request.destinations,
+        request.nearby_km,
+        version
+    ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def parse_fields(fields: Optional[str], compact: bool) -> Optional[Tuple[str, ...]]:
+    """Validate the fields= selection; None means the full Flight objects"""
+    if not fields:
+        return COMPACT_DEFAULT_FIELDS if compact else None
+    selected = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in selected if name not in SELECTABLE_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(SELECTABLE_FIELDS))}"
+        )
+    return selected
+
+def search_params(request: FlightSearchRequest, airports: Optional[Tuple[List[str], List[str]]] = None) -> dict:
+    params = {
+        "from": request.from_city,
+        "to": request.to_city,
+        "date": request.departure_date,
+        "passengers": request.passengers
+    }
+    if airports:
+        params["origins"], params["destinations"] = airports
+    return params
+
+def search_airports(network: RouteNetwork, names: List[str], nearby_km: Optional[float]) -> List[str]:
+    """Airport codes one side of a multi-airport search covers, nearest first
+
+    Places the network does not know are kept as given, for the mock generator.
+    """
+    airports = []
+    for name in names:
+        codes = network.resolve(name)
+        if not codes:
+            airports.append(name)
+        for code in codes:
+            airports.extend(network.nearby(code, nearby_km) if nearby_km else [code])
+    return list(dict.fromkeys(airports))[:MAX_SEARCH_AIRPORTS]
+
+async def search_rows(request: FlightSearchRequest, fingerprint: str, fields: FrozenSet[str], offload: bool = False) -> Tuple[List[dict], Optional[Tuple[List[str], List[str]]]]:
+    """Price-sorted rows for a search, plus the airports searched when there are several
+
+    A multi-airport search runs one search per origin/destination pair
+    concurrently and k-way merges their price-sorted lists, so only the
+    rows that make the cut are ever pulled from each pair. A single-pair
+    search runs inline unless offload is set, as it is for background
+    warmup, which must not hold up the event loop.
+    """
+    # Seeding from the fingerprint makes repeated searches return identical results
+    if not request.multi_airport:
+        generate = functools.partial(
+            generate_flight_rows,
+            request.from_city,
+            request.to_city,
+            request.departure_date,
+            request.premium,
+            rng=random.Random(int(fingerprint[:16], 16)),
+            fields=fields
+        )
+        rows = await asyncio.to_thread(generate) if offload else generate()
+        return rows, None
+
+    network = default_network()
+    origins = search_airports(network, [request.from_city, *request.origins], request.nearby_km)
+    destinations = search_airports(network, [request.to_city, *request.destinations], request.nearby_km)
+    pairs = [(origin, destination) for origin in origins for destination in destinations if origin != destination]
+
+    def pair_rng(origin: str, destination: str) -> random.Random:
+        return random.Random(int(hashlib.sha256(f"{fingerprint}:{origin}:{destination}".encode()).hexdigest()[:16], 16))
+
+    per_pair = await asyncio.gather(*(
+        asyncio.to_thread(
+            generate_flight_rows, origin, destination, request.departure_date, request.premium,
+            pair_rng(origin, destination), fields | {"price"}
+        )
+        for origin, destination in pairs
+    ))
+    limit = max(map(len, per_pair), default=0) if request.premium else 3
+    rows = list(islice(heapq.merge(*per_pair, key=lambda row: row["price"]), limit))
+    if "price" not in fields:
+        for row in rows:
+            del row["price"]
+    return rows, (origins, destinations)
+
+def response_etag(fingerprint: str, fields: Optional[Tuple[str, ...]], compact: bool) -> str:
+    """Weak ETag for one representation of a search result; weak because the
+    identity, gzip and brotli encodings of the body all carry it"""
+    if fields is None:
+        return f'W/"{fingerprint[:32]}"'
+    variant = f"{fingerprint}:{int(compact)}:{','.join(fields)}"
+    return f'W/"{hashlib.sha256(variant.encode()).hexdigest()[:32]}"'
+
+async def cached_search_rows(cache: SearchCache, request: FlightSearchRequest, fingerprint: str) -> Tuple[List[dict], Optional[Tuple[List[str], List[str]]]]:
+    """Full result rows for a search, computed once per fingerprint; callers must not modify them"""
+    entry = cache.get(fingerprint)
+    if entry is None:
+        entry = await search_rows(request, fingerprint, ALL_FLIGHT_FIELDS)
+        cache.put(fingerprint, entry)
+    return entry
+
+def project_row(row: dict, fields: FrozenSet[str]) -> dict:
+    """Copy of a full result row holding only the selected fields"""
+    projected = {}
+    for name in fields:
+        key, _, part = name.partition(".")
+        if part:
+            projected.setdefault(key, {})[part] = row[key][part]
+        else:
+            projected[key] = row[key]
+    return projected
+
+async def run_search(request: FlightSearchRequest, fingerprint: str, cache: SearchCache) -> FlightSearchResponse:
+    rows, airports = await cached_search_rows(cache, request, fingerprint)
+    flights = [Flight(**row) for row in rows]
+    return FlightSearchResponse(
+        flights=flights,
+        total_results=len(flights),
+        search_params=search_params(request, airports),
+        premium_features_used=request.premium
+    )
+
+async def run_trimmed_search(request: FlightSearchRequest, fingerprint: str, fields: Tuple[str, ...], compact: bool, cache: SearchCache) -> Tuple[dict, Optional[int]]:
+    """Search returning only the selected fields, as parallel arrays when compact
+
+    Cached results are projected; otherwise only the selected fields are
+    built and no Flight models are created. Values match the full response
+    for the same fingerprint. Also returns the cheapest fare for the price
+    history.
+    """
+    # Price is always built (it is cheap) so the cheapest fare can be recorded
+    built_fields = frozenset(fields) | {"price"}
+    entry = cache.get(fingerprint)
+    if entry is not None:
+        rows, airports = [project_row(row, built_fields) for row in entry[0]], entry[1]
+    else:
+        rows, airports = await search_rows(request, fingerprint, built_fields)
+    cheapest_price = rows[0]["price"] if rows else None
+    if "price" not in fields:
+        for row in rows:
+            del row["price"]
+    if compact:
+        flights = {}
+        for name in fields:
+            key, _, part = name.partition(".")
+            flights[name] = [row[key][part] for row in rows] if part else [row[key] for row in rows]
+    else:
+        flights = rows
+    return {
+        "flights": flights,
+        "fields": list(fields),
+        "total_results": len(rows),
+        "search_params": search_params(request, airports),
+        "premium_features_used": request.premium
+    }, cheapest_price
+
+def cheapest_fare(flights: List[Flight]) -> Optional[int]:
+    return min((flight.price for flight in flights), default=None)
+
+def route_end_key(name: str) -> str:
+    """The airport codes a city name or code resolves to, so spellings of one place share a key"""
+    codes = default_network().resolve(name)
+    return "+".join(sorted(codes)) if codes else name.strip().upper()
+
+def route_key(from_city: str, to_city: str) -> str:
+    return f"{route_end_key(from_city)}-{route_end_key(to_city)}"
+
+async def prewarm_search(cache: SearchCache, search: dict, version: int):
+    """Compute a popular search for a result window ahead of its first request"""
+    request = FlightSearchRequest(**{
+        "from": search["from_city"],
+        "to": search["to_city"],
+        "departureDate": search["departure_date"],
+        "passengers": search["passengers"],
+        "premium": search["premium"]
+    })
+    fingerprint = search_fingerprint(request, version)
+    if fingerprint not in cache:
+        cache.put(fingerprint, await search_rows(request, fingerprint, ALL_FLIGHT_FIELDS, offload=True))
+
+async def record_search(storage: Storage, request: FlightSearchRequest, version: int, results_count: int, cheapest_price: Optional[int] = None):
+    """Store search in database for analytics, and its cheapest fare in the route's price history
+
+    Results are fixed within a result version, so the history keeps one
+    sample per route per version however often the route is searched.
+    """
+    now = datetime.utcnow()
+    search_record = {
+        "id": str(uuid.uuid4()),
+        "from_city": request.from_city,
+        "to_city": request.to_city,
+        "departure_date": request.departure_date,
+        "passengers": request.passengers,
+        "premium": request.premium,
+        "results_count": results_count,
+        "timestamp": now
+    }
+    writes = [storage.flight_searches.insert(search_record)]
+    # A multi-airport search's cheapest fare may not be for this route
+    if cheapest_price is not None and not request.multi_airport:
+        writes.append(storage.price_history.record(route_key(request.from_city, request.to_city), now, cheapest_price, version))
+    await asyncio.gather(*writes)
+
+# Per-worker resources
+def get_storage(request: Request) -> Storage:
+    """Return the storage backend owned by the current worker's app"""
+    return request.app.state.storage
+
+def get_search_cache(request: Request) -> SearchCache:
+    return request.app.state.search_cache
+
+def get_stripe_checkout(http_request: Request) -> "StripeCheckout":
+    """Return the worker's StripeCheckout, importing the integration on first use"""
+    if not stripe_api_key:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
+
+    state = http_request.app.state
+    if state.stripe_checkout is None:
+        from emergentintegrations.payments.stripe.checkout import StripeCheckout
+
+        host_url = str(http_request.base_url)
+        webhook_url = f"{host_url}api/webhook/stripe"
+        state.stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    return state.stripe_checkout
 
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "FlySnipe API is running", "status": "OK"}
 
-@api_router.post("/flights/search", response_model=FlightSearchResponse)
-async def search_flights(request: FlightSearchRequest):
-    """Search for flights between two cities"""
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    """Readiness probe: Mongo ping latency, connection pool usage and search cache warmup"""
+    result = await request.app.state.readiness.check()
+    return JSONResponse(result, status_code=200 if result["status"] == "ready" else 503)
+
+@api_router.get("/metrics/search-cache")
+async def search_cache_metrics(cache: SearchCache = Depends(get_search_cache)):
+    """Report search cache size and hit counts for this worker"""
+    return cache.metrics()
+
+@api_router.get("/usage")
+async def search_usage(request: Request):
+    """Report the caller's search quota and usage in the current window"""
+    meter = request.app.state.usage
+    user = usage_identity(request)
+    return meter.usage(user, await meter.tier(user))
+
+@api_router.get("/metrics/usage")
+async def usage_metrics(request: Request):
+    """Report metering counters and flush volume for this worker"""
+    return request.app.state.usage.metrics()
+
+@api_router.get("/metrics/admission")
+async def admission_metrics(request: Request):
+    """Report admission queue depth and shed counts for this worker"""
+    return {name: gate.metrics() for name, gate in request.app.state.admission.items()}
+
+@api_router.post("/flights/search", response_model=FlightSearchResponse, dependencies=[Depends(admission_guard("search")), Depends(meter_search)])
+async def search_flights(
+    request: FlightSearchRequest,
+    fields: Optional[str] = None,
+    compact: bool = False,
+    storage: Storage = Depends(get_storage),
+    cache: SearchCache = Depends(get_search_cache)
+):
+    """Search for flights between two cities
+
+    origins/destinations add more airports and nearbyKm every airport within
+    that radius; the per-pair results are merged into one ranked list.
+    fields=a,b,departure.time returns only those fields; compact=true returns
+    them as parallel arrays (defaulting to what the extension renders).
+    """
+    selected = parse_fields(fields, compact)
     try:
-        # Generate mock flight data
-        flights = generate_mock_flights(
-            request.from_city, 
-            request.to_city, 
-            request.departure_date,
-            request.premium
-        )
+        version = search_result_version(time.time())
+        fingerprint = search_fingerprint(request, version)
+        if selected:
+            trimmed, cheapest_price = await run_trimmed_search(request, fingerprint, selected, compact, cache)
+            await record_search(storage, request, version, trimmed["total_results"], cheapest_price)
+            return JSONResponse(trimmed)
         
-        # Store search in database for analytics
-        search_record = {
-            "id": str(uuid.uuid4()),
-            "from_city": request.from_city,
-            "to_city": request.to_city,
-            "departure_date": request.departure_date,
-            "passengers": request.passengers,
-            "premium": request.premium,
-            "results_count": len(flights),
-            "timestamp": datetime.utcnow()
-        }
-        await db.flight_searches.insert_one(search_record)
+        result = await run_search(request, fingerprint, cache)
+        await record_search(storage, request, version, result.total_results, cheapest_fare(result.flights))
+        return result
         
-        return FlightSearchResponse(
-            flights=flights,
-            total_results=len(flights),
+    except Exception as e:
+        record_error("Flight search error", e)
+        raise HTTPException(status_code=500, detail="Failed to search flights")
+
+@api_router.get("/flights/search", response_model=FlightSearchResponse, dependencies=[Depends(admission_guard("search")), Depends(meter_search)])
+async def search_flights_cacheable(
+    http_request: Request,
+    response: Response,
+    from_city: str = Query(..., alias="from"),
+    to_city: str = Query(..., alias="to"),
+    departure_date: str = Query(..., alias="departureDate"),
+    passengers: int = 1,
+    premium: bool = False,
+    origins: List[str] = Query([], max_length=MAX_SEARCH_AIRPORTS),
+    destinations: List[str] = Query([], max_length=MAX_SEARCH_AIRPORTS),
+    nearby_km: Optional[float] = Query(None, alias="nearbyKm", gt=0, le=MAX_NEARBY_KM),
+    fields: Optional[str] = None,
+    compact: bool = False,
+    storage: Storage = Depends(get_storage),
+    cache: SearchCache = Depends(get_search_cache)
+):
+    """HTTP-cacheable flight search; answers 304 when If-None-Match still matches"""
+    selected = parse_fields(fields, compact)
+    try:
+        request = FlightSearchRequest(**{
+            "from": from_city,
+            "to": to_city,
+            "departureDate": departure_date,
+            "passengers": passengers,
+            "premium": premium,
+            "origins": origins,
+            "destinations": destinations,
+            "nearbyKm": nearby_km
+        })
+    except ValidationError as e:
+        # Answer 422 like the POST endpoint rather than a 500
+        raise RequestValidationError(e.errors())
+    try:
+        now = time.time()
+        version = search_result_version(now)
+        fingerprint = search_fingerprint(request, version)
+        etag = response_etag(fingerprint, selected, compact)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"private, max-age={SEARCH_RESULT_TTL - int(now) % SEARCH_RESULT_TTL}"
+        }
+
+        # The client already holds this exact result, so skip generating it
+        if etag_matches(http_request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if selected:
+            trimmed, cheapest_price = await run_trimmed_search(request, fingerprint, selected, compact, cache)
+            await record_search(storage, request, version, trimmed["total_results"], cheapest_price)
+            return JSONResponse(trimmed, headers=headers)
+
+        result = await run_search(request, fingerprint, cache)
+        await record_search(storage, request, version, result.total_results, cheapest_fare(result.flights))
+        response.headers.update(headers)
+        return result
+
+    except Exception as e:
+        record_error("Flight search error", e)
+        raise HTTPException(status_code=500, detail="Failed to search flights")
+
+@api_router.post("/flights/itineraries", response_model=ItinerarySearchResponse, dependencies=[Depends(admission_guard("search")), Depends(meter_search)])
+async def search_itineraries(
+    request: ItinerarySearchRequest,
+    storage: Storage = Depends(get_storage),
+    cache: SearchCache = Depends(get_search_cache)
+):
+    """Search round-trip and multi-city itineraries, returning the k cheapest combinations"""
+    try:
+        version = search_result_version(time.time())
+        leg_requests = [
+            FlightSearchRequest(**{
+                "from": leg.from_city,
+                "to": leg.to_city,
+                "departureDate": leg.departure_date,
+                "passengers": request.passengers,
+                "premium": request.premium
+            })
+            for leg in request.legs
+        ]
+
+        # Each leg's results come back sorted by price, as the heap merge requires
+        leg_results = await asyncio.gather(*(
+            run_search(leg, search_fingerprint(leg, version), cache) for leg in leg_requests
+        ))
+        k = request.k if request.premium else min(request.k, 3)
+        combinations = k_cheapest_combinations(
+            [result.flights for result in leg_results], k, price=lambda flight: flight.price
+        )
+
+        await asyncio.gather(*(
+            record_search(storage, leg, version, result.total_results, cheapest_fare(result.flights))
+            for leg, result in zip(leg_requests, leg_results)
+        ))
+
+        itineraries = [
+            Itinerary(
+                legs=flights,
+                total_price=total_price,
+                total_duration_minutes=sum(flight.duration_minutes for flight in flights)
+            )
+            for total_price, flights in combinations
+        ]
+        return ItinerarySearchResponse(
+            itineraries=itineraries,
+            total_results=len(itineraries),
             search_params={
-                "from": request.from_city,
-                "to": request.to_city,
-                "date": request.departure_date,
+                "legs": [
+                    {"from": leg.from_city, "to": leg.to_city, "date": leg.departure_date}
+                    for leg in request.legs
+                ],
                 "passengers": request.passengers
             },
             premium_features_used=request.premium
         )
-        
+
     except Exception as e:
-        logging.error(f"Flight search error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to search flights")
+        record_error("Itinerary search error", e)
+        raise HTTPException(status_code=500, detail="Failed to search itineraries")
+
+@api_router.get("/routes/{from_city}/{to_city}/history")
+async def route_price_history(
+    from_city: str,
+    to_city: str,
+    days: int = Query(30, ge=1, le=365),
+    samples: bool = False,
+    storage: Storage = Depends(get_storage)
+):
+    """Daily fare trend for a route and how the latest fare compares with normal
+
+    Reads one bucket per day in a single range query; samples=true adds the
+    packed per-day (seconds into day, price) arrays for charting.
+    """
+    try:
+        route = route_key(from_city, to_city)
+        today = datetime.utcnow().date()
+        first_day = (today - timedelta(days=days - 1)).isoformat()
+        buckets = await storage.price_history.range(route, first_day, today.isoformat())
+
+        daily = []
+        for bucket in buckets:
+            day = {
+                "day": bucket["day"],
+                "min": bucket["min"],
+                "max": bucket["max"],
+                "avg": round(bucket["sum"] / bucket["count"], 2),
+                "count": bucket["count"]
+            }
+            if samples:
+                day["t"] = bucket["t"]
+                day["p"] = bucket["p"]
+            daily.append(day)
+
+        summary = None
+        if buckets:
+            normal = sum(bucket["sum"] for bucket in buckets) / sum(bucket["count"] for bucket in buckets)
+            latest = buckets[-1]["p"][-1]
+            summary = {
+                "min": min(bucket["min"] for bucket in buckets),
+                "max": max(bucket["max"] for bucket in buckets),
+                "avg": round(normal, 2),
+                "latest": latest,
+                # Negative when the latest fare is below the route's normal price
+                "vs_normal_pct": round((latest - normal) / normal * 100, 1)
+            }
+
+        return {"route": route, "days": daily, "summary": summary}
+
+    except Exception as e:
+        record_error("Price history error", e)
+        raise HTTPException(status_code=500, detail="Failed to get price history")
 
 @api_router.post("/auth/google")
-async def google_auth(request: Request):
+async def google_auth(request: Request, storage: Storage = Depends(get_storage)):
     """Handle Google authentication (mock for now)"""
     body = await request.json()
     token = body.get("id_token")
@@ -227,38 +933,36 @@ async def google_auth(request: Request):
     # Mock verification - replace with real Google token verification
     mock_email = "user@example.com"
     
-    # Check if user exists, create if not
-    user = await db.users.find_one({"email": mock_email})
-    if not user:
+    # Repeat logins are answered from memory; otherwise one atomic upsert
+    # finds the user or creates it
+    recent_users = request.app.state.recent_users
+    user = recent_users.get(mock_email)
+    if user is None:
         new_user = User(email=mock_email, name="Mock User")
-        await db.users.insert_one(new_user.dict())
-        user = new_user.dict()
+        user = await storage.users.get_or_create(
+            mock_email, new_user.dict(exclude={"email"}), fields=["email", "name"]
+        )
+        recent_users.put(mock_email, user)
     
-    return {"email": mock_email, "name": user.get("name", "User")}
+    # Send as `Authorization: Bearer <session_token>` to search on this account's quota
+    session_token = request.app.state.sessions.issue(mock_email)
+    return {"email": mock_email, "name": user.get("name", "User"), "session_token": session_token}
 
 @api_router.get("/check-premium")
-async def check_premium(email: str):
+async def check_premium(email: str, storage: Storage = Depends(get_storage)):
     """Check if user has premium subscription"""
-    user = await db.users.find_one({"email": email})
-    if not user:
+    user = await storage.users.get(email, fields=["is_premium"])
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     return {"email": email, "is_premium": user.get("is_premium", False)}
 
-@api_router.post("/create-checkout-session")
-async def create_checkout_session(request: CheckoutRequest, http_request: Request):
+@api_router.post("/create-checkout-session", dependencies=[Depends(admission_guard("checkout"))])
+async def create_checkout_session(request: CheckoutRequest, http_request: Request, storage: Storage = Depends(get_storage)):
     """Create Stripe checkout session for premium upgrade"""
     try:
-        global stripe_checkout
-        
-        if not stripe_api_key:
-            raise HTTPException(status_code=500, detail="Stripe not configured")
-        
-        # Initialize Stripe checkout if not already done
-        if not stripe_checkout:
-            host_url = str(http_request.base_url)
-            webhook_url = f"{host_url}api/webhook/stripe"
-            stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        stripe_checkout = get_stripe_checkout(http_request)
+        from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
         
         # Validate package
         if request.package_id not in PREMIUM_PACKAGES:
@@ -284,7 +988,8 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
             }
         )
         
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+        with phase("stripe.create_checkout_session"):
+            session = await stripe_checkout.create_checkout_session(checkout_request)
         
         # Store payment transaction
         transaction = PaymentTransaction(
@@ -297,52 +1002,56 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
             metadata=checkout_request.metadata
         )
         
-        await db.payment_transactions.insert_one(transaction.dict())
+        await storage.payment_transactions.insert(transaction.dict())
         
         return {"url": session.url, "session_id": session.session_id}
         
     except Exception as e:
-        logging.error(f"Checkout session creation error: {str(e)}")
+        record_error("Checkout session creation error", e)
         raise HTTPException(status_code=500, detail="Failed to create checkout session")
 
+async def settle_payment(storage: Storage, session_id: str) -> bool:
+    """Mark a transaction completed and upgrade its user, exactly once per session
+
+    The conditional complete_if_pending is the only gate: when status polls
+    and webhooks race, just one caller gets the pending transaction back.
+    If the user upgrade then fails, the transaction goes back to pending so
+    the next status poll or webhook retry settles it again.
+    """
+    transaction = await storage.payment_transactions.complete_if_pending(session_id, datetime.utcnow())
+    if not transaction:
+        return False
+    
+    # Upgrade user to premium if email provided
+    if transaction["email"] != "anonymous":
+        try:
+            await storage.users.update(
+                transaction["email"],
+                {
+                    "is_premium": True,
+                    "premium_activated_at": datetime.utcnow(),
+                    "subscription_type": transaction["package_id"]
+                },
+                upsert=True
+            )
+        except Exception:
+            await storage.payment_transactions.revert_to_pending(session_id, datetime.utcnow())
+            raise
+    return True
+
 @api_router.get("/payments/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
+async def get_checkout_status(session_id: str, http_request: Request, storage: Storage = Depends(get_storage)):
     """Get checkout session status"""
     try:
-        if not stripe_checkout:
-            raise HTTPException(status_code=500, detail="Stripe not configured")
+        stripe_checkout = get_stripe_checkout(http_request)
         
         # Get status from Stripe
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+        with phase("stripe.get_checkout_status"):
+            checkout_status = await stripe_checkout.get_checkout_status(session_id)
         
-        # Update local transaction
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        if transaction and transaction["payment_status"] != "completed":
-            if checkout_status.payment_status == "paid":
-                # Update transaction
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {
-                        "$set": {
-                            "payment_status": "completed",
-                            "updated_at": datetime.utcnow()
-                        }
-                    }
-                )
-                
-                # Upgrade user to premium if email provided
-                if transaction["email"] != "anonymous":
-                    await db.users.update_one(
-                        {"email": transaction["email"]},
-                        {
-                            "$set": {
-                                "is_premium": True,
-                                "premium_activated_at": datetime.utcnow(),
-                                "subscription_type": transaction["package_id"]
-                            }
-                        },
-                        upsert=True
-                    )
+        # Update local transaction and user
+        if checkout_status.payment_status == "paid":
+            await settle_payment(storage, session_id)
         
         return {
             "status": checkout_status.status,
@@ -353,15 +1062,14 @@ async def get_checkout_status(session_id: str):
         }
         
     except Exception as e:
-        logging.error(f"Checkout status error: {str(e)}")
+        record_error("Checkout status error", e)
         raise HTTPException(status_code=500, detail="Failed to get checkout status")
 
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request):
+async def stripe_webhook(request: Request, storage: Storage = Depends(get_storage)):
     """Handle Stripe webhooks"""
     try:
-        if not stripe_checkout:
-            raise HTTPException(status_code=500, detail="Stripe not configured")
+        stripe_checkout = get_stripe_checkout(request)
         
         # Get raw body and signature
         body = await request.body()
@@ -371,47 +1079,24 @@ async def stripe_webhook(request: Request):
             raise HTTPException(status_code=400, detail="Missing Stripe signature")
         
         # Handle webhook
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
+        with phase("stripe.handle_webhook"):
+            webhook_response = await stripe_checkout.handle_webhook(body, signature)
         
         if webhook_response.event_type == "checkout.session.completed":
             # Update transaction and user
-            transaction = await db.payment_transactions.find_one({"session_id": webhook_response.session_id})
-            if transaction:
-                await db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {
-                        "$set": {
-                            "payment_status": "completed",
-                            "updated_at": datetime.utcnow()
-                        }
-                    }
-                )
-                
-                # Upgrade user to premium
-                if transaction["email"] != "anonymous":
-                    await db.users.update_one(
-                        {"email": transaction["email"]},
-                        {
-                            "$set": {
-                                "is_premium": True,
-                                "premium_activated_at": datetime.utcnow(),
-                                "subscription_type": transaction["package_id"]
-                            }
-                        },
-                        upsert=True
-                    )
+            await settle_payment(storage, webhook_response.session_id)
         
         return {"status": "success", "event_type": webhook_response.event_type}
         
     except Exception as e:
-        logging.error(f"Stripe webhook error: {str(e)}")
+        record_error("Stripe webhook error", e)
         raise HTTPException(status_code=500, detail="Webhook processing failed")
 
 @api_router.get("/verify-session")
-async def verify_session(session_id: str):
+async def verify_session(session_id: str, storage: Storage = Depends(get_storage)):
     """Verify Stripe session and upgrade user to premium"""
     # Mock verification - replace with real Stripe verification
-    upgrade = await db.premium_upgrades.find_one({"session_id": session_id})
+    upgrade = await storage.premium_upgrades.get(session_id)
     
     if not upgrade:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -420,50 +1105,140 @@ async def verify_session(session_id: str):
         return {"status": "already_processed", "email": upgrade["email"]}
     
     # Update user to premium
-    await db.users.update_one(
-        {"email": upgrade["email"]},
-        {"$set": {"is_premium": True, "premium_activated_at": datetime.utcnow()}}
+    await storage.users.update(
+        upgrade["email"],
+        {"is_premium": True, "premium_activated_at": datetime.utcnow()}
     )
     
     # Mark upgrade as completed
-    await db.premium_upgrades.update_one(
-        {"session_id": session_id},
-        {"$set": {"status": "completed", "completed_at": datetime.utcnow()}}
-    )
+    await storage.premium_upgrades.mark_completed(session_id, datetime.utcnow())
     
     return {"status": "success", "email": upgrade["email"]}
 
+@api_router.get("/export/{collection}", dependencies=[Depends(require_export_token)])
+async def export_collection(
+    collection: str,
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after: Optional[str] = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=50000),
+    storage: Storage = Depends(get_storage)
+):
+    """Stream flight_searches or payment_transactions as CSV or Parquet
+
+    start (inclusive) and end (exclusive) filter by creation time; after=
+    resumes after the export_id of the last row received.
+    """
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown collection. Exportable: {', '.join(sorted(EXPORTS))}")
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid after: expected an export_id")
+    return StreamingResponse(
+        stream_export(storage, collection, format, start, end, after, batch_size),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{collection}.{format}"'}
+    )
+
 # Legacy routes
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(input: StatusCheckCreate, storage: Storage = Depends(get_storage)):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await storage.status_checks.insert(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(storage: Storage = Depends(get_storage)):
+    status_checks = await storage.status_checks.list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+# Request timing records are bare JSON lines, outside the text format above
+request_log_handler = logging.StreamHandler()
+request_log_handler.setFormatter(logging.Formatter('%(message)s'))
+request_log.addHandler(request_log_handler)
+request_log.propagate = False
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def ensure_indexes(storage: Storage):
+    try:
+        await storage.ensure_indexes()
+    except Exception as e:
+        logging.error(f"Index creation error: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's storage after the fork and close it on shutdown"""
+    storage = create_storage()
+    app.state.storage = storage
+    search_cache = SearchCache(int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '5000')))
+    app.state.search_cache = search_cache
+    warmer = build_warmer(
+        storage,
+        lambda search, version: prewarm_search(search_cache, search, version),
+        window=SEARCH_RESULT_TTL
+    )
+    app.state.readiness = ReadinessProbe(
+        storage,
+        cache_ttl=float(os.environ.get('HEALTH_CACHE_TTL_MS', '2000')) / 1000,
+        warmer=warmer
+    )
+    app.state.stripe_checkout = None
+    app.state.admission = build_gates()
+    app.state.recent_users = build_recent_users()
+    app.state.sessions = build_sessions()
+    meter = build_meter(storage)
+    app.state.usage = meter
+    # Load the route network and build its adjacency before taking traffic
+    default_network()
+    # Index builds must not block startup when the database is slow or down
+    index_task = asyncio.create_task(ensure_indexes(storage))
+    # Popular searches are precomputed in the background; readiness waits for it
+    warmup_task = asyncio.create_task(warmer.run())
+    # Usage counts are reloaded and then flushed in the background
+    metering_task = asyncio.create_task(meter.run())
+    try:
+        yield
+    finally:
+        metering_task.cancel()
+        warmup_task.cancel()
+        index_task.cancel()
+        # Write out the last counts before the connection closes
+        try:
+            await asyncio.wait_for(meter.flush(reload=False), timeout=5)
+        except Exception as e:
+            logging.error(f"Usage flush error: {str(e)}")
+        storage.close()
+
+def create_app() -> FastAPI:
+    """Build the FlySnipe app; connections are opened by the lifespan, not here"""
+    app = FastAPI(title="FlySnipe API", version="1.0.0", lifespan=lifespan)
+
+    # Include the router in the main app
+    app.include_router(api_router)
+    app.add_exception_handler(RequestValidationError, refund_invalid_search)
+
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outermost, so the breakdown covers every other middleware too
+    app.add_middleware(
+        TimingMiddleware,
+        sample_rate=float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '0.01'))
+    )
+    return app
+
+app = create_app()
@@ -0,0 +1,635 @@
+"""
+Storage layer for the FlySnipe API.
+
+Endpoints talk to one repository per collection (users,
+payment_transactions, premium_upgrades, flight_searches, status_checks,
+price_history, usage) instead of raw Motor handles. MongoStorage is the production backend;
+MemoryStorage keeps the same semantics in process (unique indexes,
+upserts, conditional updates) so the API can be tested and benchmarked
+offline. STORAGE_BACKEND=memory selects the in-memory backend.
+"""
+
+import copy
+import os
+from collections import Counter
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from mongo import create_mongo_client
+from timing import TimedRepository, timed
+
+
+def _export_query(time_field: str, start: Optional[datetime], end: Optional[datetime], after: Optional[str]) -> dict:
+    """Documents with start <= time_field < end whose _id sorts after the checkpoint"""
+    query: Dict[str, Any] = {}
+    if start is not None or end is not None:
+        query[time_field] = {}
+        if start is not None:
+            query[time_field]["$gte"] = start
+        if end is not None:
+            query[time_field]["$lt"] = end
+    if after is not None:
+        query["_id"] = {"$gt": ObjectId(after)}
+    return query
+
+
+def _projection(fields: Optional[Sequence[str]]) -> Optional[Dict[str, int]]:
+    if fields is None:
+        return None
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+# Repository interfaces
+class UsersRepository(ABC):
+    @abstractmethod
+    async def get(self, email: str, fields: Optional[Sequence[str]] = None) -> Optional[dict]:
+        """Return the user, limited to fields when given"""
+
+    @abstractmethod
+    async def insert(self, user: dict) -> None:
+        """Insert a new user; raises DuplicateKeyError if the email exists"""
+
+    @abstractmethod
+    async def get_or_create(self, email: str, defaults: dict, fields: Sequence[str]) -> dict:
+        """Return the user, limited to fields, inserting email plus defaults first if missing"""
+
+    @abstractmethod
+    async def update(self, email: str, changes: dict, upsert: bool = False) -> None:
+        """$set changes on the user, creating it when upsert is true"""
+
+
+class PaymentTransactionsRepository(ABC):
+    @abstractmethod
+    async def insert(self, transaction: dict) -> None:
+        """Insert a new transaction; raises DuplicateKeyError if the session exists"""
+
+    @abstractmethod
+    async def complete_if_pending(self, session_id: str, updated_at: datetime) -> Optional[dict]:
+        """Mark the session completed unless it already is
+
+        Returns the email and package_id of the transaction to the one caller
+        that completed it, None to everyone else.
+        """
+
+    @abstractmethod
+    async def revert_to_pending(self, session_id: str, updated_at: datetime) -> None:
+        """Undo complete_if_pending when the work it gated failed, so a retry can settle again"""
+
+    @abstractmethod
+    def batches(
+        self, start: Optional[datetime], end: Optional[datetime], after: Optional[str], batch_size: int
+    ) -> AsyncIterator[List[dict]]:
+        """Transactions created in [start, end) after the `after` _id, in _id order, batch_size at a time"""
+
+
+class PremiumUpgradesRepository(ABC):
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[dict]:
+        """Return the upgrade for a session"""
+
+    @abstractmethod
+    async def mark_completed(self, session_id: str, completed_at: datetime) -> None:
+        """Mark the upgrade for a session completed"""
+
+
+class FlightSearchesRepository(ABC):
+    @abstractmethod
+    async def insert(self, search: dict) -> None:
+        """Record one search for analytics"""
+
+    @abstractmethod
+    async def popular(self, since: datetime, first_date: str, limit: int) -> List[dict]:
+        """Most repeated searches made since `since` departing on or after first_date
+
+        Each entry holds from_city, to_city, departure_date, passengers,
+        premium and count, most searched first.
+        """
+
+    @abstractmethod
+    def batches(
+        self, start: Optional[datetime], end: Optional[datetime], after: Optional[str], batch_size: int
+    ) -> AsyncIterator[List[dict]]:
+        """Searches made in [start, end) after the `after` _id, in _id order, batch_size at a time"""
+
+
+class PriceHistoryRepository(ABC):
+    """Per-route price samples, bucketed into one document per route per day
+
+    A bucket holds packed parallel arrays of sample offsets (seconds into
+    the day) and prices, capped at max_samples, plus count/sum/min/max over
+    every sample the day has seen, and the result version of the last one.
+    """
+
+    @abstractmethod
+    async def record(self, route: str, observed_at: datetime, price: int, version: int) -> None:
+        """Add one price sample to the route's bucket for the observation day,
+        unless the bucket already has one for this result version"""
+
+    @abstractmethod
+    async def range(self, route: str, first_day: str, last_day: str) -> List[dict]:
+        """Buckets for first_day..last_day (YYYY-MM-DD, inclusive), oldest first"""
+
+
+class UsageRepository(ABC):
+    """Search counts per user per metering window"""
+
+    @abstractmethod
+    async def add(self, increments: Dict[Tuple[str, int], int], expires_at: datetime) -> None:
+        """Add each (user, window) increment in one batch, keeping counts until expires_at"""
+
+    @abstractmethod
+    async def load(self, window: int) -> Dict[str, int]:
+        """Counts per user for one window"""
+
+
+class StatusChecksRepository(ABC):
+    @abstractmethod
+    async def insert(self, status_check: dict) -> None:
+        """Insert a status check"""
+
+    @abstractmethod
+    async def list(self, limit: int) -> List[dict]:
+        """Return up to limit status checks"""
+
+
+class Storage(ABC):
+    users: UsersRepository
+    payment_transactions: PaymentTransactionsRepository
+    premium_upgrades: PremiumUpgradesRepository
+    flight_searches: FlightSearchesRepository
+    status_checks: StatusChecksRepository
+    price_history: PriceHistoryRepository
+    usage: UsageRepository
+
+    @abstractmethod
+    async def ensure_indexes(self) -> None:
+        """Create the indexes the repositories rely on"""
+
+    @abstractmethod
+    async def ping(self) -> None:
+        """Raise if the backend cannot serve requests"""
+
+    def pool_stats(self) -> Optional[Dict]:
+        """Connection pool counters, for backends that have a pool"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+# Fields that identify a repeated search in flight_searches
+SEARCH_KEY_FIELDS = ("from_city", "to_city", "departure_date", "passengers", "premium")
+
+
+# MongoDB backend
+INDEXES = {
+    "users": [IndexModel([("email", ASCENDING)], unique=True)],
+    "payment_transactions": [IndexModel([("session_id", ASCENDING)], unique=True)],
+    "premium_upgrades": [IndexModel([("session_id", ASCENDING)], unique=True)],
+    "flight_searches": [IndexModel([("timestamp", DESCENDING)])],
+    "price_history": [IndexModel([("route", ASCENDING), ("day", ASCENDING)], unique=True)],
+    "usage": [
+        IndexModel([("user", ASCENDING), ("window", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Samples kept per price history bucket; the aggregates still cover all of them
+PRICE_HISTORY_MAX_SAMPLES = int(os.environ.get("PRICE_HISTORY_MAX_SAMPLES", "288"))
+
+
+def _bucket_key(observed_at: datetime):
+    day = observed_at.strftime("%Y-%m-%d")
+    offset = observed_at.hour * 3600 + observed_at.minute * 60 + observed_at.second
+    return day, offset
+
+
+async def _mongo_batches(collection, time_field, start, end, after, batch_size):
+    # to_list(n) resumes the cursor, so only one batch is held at a time
+    cursor = collection.find(_export_query(time_field, start, end, after))
+    cursor = cursor.sort("_id", ASCENDING).batch_size(batch_size)
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+class MongoUsers(UsersRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, email, fields=None):
+        return await self.collection.find_one({"email": email}, _projection(fields))
+
+    async def insert(self, user):
+        await self.collection.insert_one(dict(user))
+
+    async def get_or_create(self, email, defaults, fields):
+        # One round trip; the unique email index makes the server retry
+        # an upsert that loses a race instead of creating a duplicate
+        return await self.collection.find_one_and_update(
+            {"email": email},
+            {"$setOnInsert": defaults},
+            projection=_projection(fields),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def update(self, email, changes, upsert=False):
+        await self.collection.update_one({"email": email}, {"$set": changes}, upsert=upsert)
+
+
+class MongoPaymentTransactions(PaymentTransactionsRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, transaction):
+        await self.collection.insert_one(dict(transaction))
+
+    async def complete_if_pending(self, session_id, updated_at):
+        # The status filter is the single gate between racing callers
+        return await self.collection.find_one_and_update(
+            {"session_id": session_id, "payment_status": {"$ne": "completed"}},
+            {"$set": {"payment_status": "completed", "updated_at": updated_at}},
+            projection=_projection(["email", "package_id"]),
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def revert_to_pending(self, session_id, updated_at):
+        await self.collection.update_one(
+            {"session_id": session_id, "payment_status": "completed"},
+            {"$set": {"payment_status": "pending", "updated_at": updated_at}},
+        )
+
+    def batches(self, start, end, after, batch_size):
+        return _mongo_batches(self.collection, "created_at", start, end, after, batch_size)
+
+
+class MongoPremiumUpgrades(PremiumUpgradesRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, session_id):
+        return await self.collection.find_one({"session_id": session_id})
+
+    async def mark_completed(self, session_id, completed_at):
+        await self.collection.update_one(
+            {"session_id": session_id},
+            {"$set": {"status": "completed", "completed_at": completed_at}},
+        )
+
+
+class MongoFlightSearches(FlightSearchesRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, search):
+        await self.collection.insert_one(dict(search))
+
+    async def popular(self, since, first_date, limit):
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": since}, "departure_date": {"$gte": first_date}}},
+            {"$group": {"_id": {field: f"${field}" for field in SEARCH_KEY_FIELDS}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": limit},
+        ]
+        results = await self.collection.aggregate(pipeline).to_list(limit)
+        return [{**result["_id"], "count": result["count"]} for result in results]
+
+    def batches(self, start, end, after, batch_size):
+        return _mongo_batches(self.collection, "timestamp", start, end, after, batch_size)
+
+
+class MongoPriceHistory(PriceHistoryRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def record(self, route, observed_at, price, version):
+        day, offset = _bucket_key(observed_at)
+        # One pipeline update decides and applies the sample atomically, and
+        # the bucket's _id is derived from (route, day), so neither the
+        # version check nor bucket uniqueness depends on secondary indexes
+        fresh = {"$ne": ["$v", version]}
+
+        def sampled(field, value):
+            appended = {"$slice": [{"$concatArrays": [{"$ifNull": [f"${field}", []]}, [value]]}, -PRICE_HISTORY_MAX_SAMPLES]}
+            return {"$cond": [fresh, appended, f"${field}"]}
+
+        def folded(field, operator, value, initial):
+            return {"$cond": [fresh, {operator: [{"$ifNull": [f"${field}", initial]}, value]}, f"${field}"]}
+
+        update = [{
+            "$set": {
+                "route": route,
+                "day": day,
+                "t": sampled("t", offset),
+                "p": sampled("p", price),
+                "count": folded("count", "$add", 1, 0),
+                "sum": folded("sum", "$add", price, 0),
+                "min": folded("min", "$min", price, price),
+                "max": folded("max", "$max", price, price),
+                "v": version,
+            }
+        }]
+        try:
+            await self.collection.update_one({"_id": f"{route}|{day}"}, update, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent first sample created the bucket; apply this one to it
+            await self.collection.update_one({"_id": f"{route}|{day}"}, update)
+
+    async def range(self, route, first_day, last_day):
+        cursor = self.collection.find(
+            {"route": route, "day": {"$gte": first_day, "$lte": last_day}},
+            {"_id": 0},
+        ).sort("day", ASCENDING)
+        return await cursor.to_list(None)
+
+
+class MongoUsage(UsageRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def add(self, increments, expires_at):
+        if not increments:
+            return
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"user": user, "window": window},
+                    {"$inc": {"count": count}, "$max": {"expires_at": expires_at}},
+                    upsert=True,
+                )
+                for (user, window), count in increments.items()
+            ],
+            ordered=False,
+        )
+
+    async def load(self, window):
+        cursor = self.collection.find({"window": window}, {"_id": 0, "user": 1, "count": 1})
+        return {doc["user"]: doc["count"] async for doc in cursor}
+
+
+class MongoStatusChecks(StatusChecksRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, status_check):
+        await self.collection.insert_one(dict(status_check))
+
+    async def list(self, limit):
+        return await self.collection.find({}, {"_id": 0}).to_list(limit)
+
+
+class MongoStorage(Storage):
+    def __init__(self, mongo_url: str, db_name: str):
+        self.client, self._pool_stats = create_mongo_client(mongo_url)
+        self.db = self.client[db_name]
+        # Every repository call shows up as a mongo.<collection>.<method> request phase
+        self.users = TimedRepository(MongoUsers(self.db.users), "mongo.users")
+        self.payment_transactions = TimedRepository(
+            MongoPaymentTransactions(self.db.payment_transactions), "mongo.payment_transactions"
+        )
+        self.premium_upgrades = TimedRepository(MongoPremiumUpgrades(self.db.premium_upgrades), "mongo.premium_upgrades")
+        self.flight_searches = TimedRepository(MongoFlightSearches(self.db.flight_searches), "mongo.flight_searches")
+        self.status_checks = TimedRepository(MongoStatusChecks(self.db.status_checks), "mongo.status_checks")
+        self.price_history = TimedRepository(MongoPriceHistory(self.db.price_history), "mongo.price_history")
+        self.usage = TimedRepository(MongoUsage(self.db.usage), "mongo.usage")
+
+    async def ensure_indexes(self):
+        for name, indexes in INDEXES.items():
+            await self.db[name].create_indexes(indexes)
+
+    @timed("mongo.ping")
+    async def ping(self):
+        await self.db.command("ping")
+
+    def pool_stats(self):
+        return self._pool_stats.snapshot()
+
+    def close(self):
+        self.client.close()
+
+
+# In-memory backend
+class MemoryCollection:
+    """Documents in insertion order plus unique indexes, mirroring INDEXES"""
+
+    def __init__(self, name: str, unique: Sequence[str] = ()):
+        self.name = name
+        self.documents: List[dict] = []
+        self.unique: Dict[str, Dict[Any, dict]] = {field: {} for field in unique}
+
+    def insert(self, document: dict) -> dict:
+        for field, index in self.unique.items():
+            if document.get(field) in index:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {field}_1"
+                )
+        stored = copy.deepcopy(document)
+        stored.setdefault("_id", ObjectId())
+        self.documents.append(stored)
+        for field, index in self.unique.items():
+            index[stored.get(field)] = stored
+        return stored
+
+    def find(self, field: str, value: Any) -> Optional[dict]:
+        if field in self.unique:
+            return self.unique[field].get(value)
+        return next((doc for doc in self.documents if doc.get(field) == value), None)
+
+
+async def _memory_batches(collection, time_field, start, end, after, batch_size):
+    after_id = ObjectId(after) if after is not None else None
+    matching = sorted(
+        (
+            doc for doc in collection.documents
+            if (start is None or doc[time_field] >= start)
+            and (end is None or doc[time_field] < end)
+            and (after_id is None or doc["_id"] > after_id)
+        ),
+        key=lambda doc: doc["_id"],
+    )
+    for i in range(0, len(matching), batch_size):
+        yield [_copy(doc) for doc in matching[i:i + batch_size]]
+
+
+def _copy(document: Optional[dict], fields: Optional[Sequence[str]] = None) -> Optional[dict]:
+    """Detached copy, projected like Mongo (without _id) when fields are given"""
+    if document is None:
+        return None
+    if fields is not None:
+        document = {field: document[field] for field in fields if field in document}
+    return copy.deepcopy(document)
+
+
+class MemoryUsers(UsersRepository):
+    def __init__(self):
+        self.collection = MemoryCollection("users", unique=["email"])
+
+    async def get(self, email, fields=None):
+        return _copy(self.collection.find("email", email), fields)
+
+    async def insert(self, user):
+        self.collection.insert(user)
+
+    async def get_or_create(self, email, defaults, fields):
+        user = self.collection.find("email", email)
+        if user is None:
+            user = self.collection.insert({"email": email, **defaults})
+        return _copy(user, fields)
+
+    async def update(self, email, changes, upsert=False):
+        user = self.collection.find("email", email)
+        if user is not None:
+            user.update(copy.deepcopy(changes))
+        elif upsert:
+            self.collection.insert({"email": email, **changes})
+
+
+class MemoryPaymentTransactions(PaymentTransactionsRepository):
+    def __init__(self):
+        self.collection = MemoryCollection("payment_transactions", unique=["session_id"])
+
+    async def insert(self, transaction):
+        self.collection.insert(transaction)
+
+    async def complete_if_pending(self, session_id, updated_at):
+        # No await between the check and the write, so this is atomic on the event loop
+        transaction = self.collection.find("session_id", session_id)
+        if transaction is None or transaction.get("payment_status") == "completed":
+            return None
+        before = _copy(transaction, ["email", "package_id"])
+        transaction.update(payment_status="completed", updated_at=updated_at)
+        return before
+
+    async def revert_to_pending(self, session_id, updated_at):
+        transaction = self.collection.find("session_id", session_id)
+        if transaction is not None and transaction.get("payment_status") == "completed":
+            transaction.update(payment_status="pending", updated_at=updated_at)
+
+    def batches(self, start, end, after, batch_size):
+        return _memory_batches(self.collection, "created_at", start, end, after, batch_size)
+
+
+class MemoryPremiumUpgrades(PremiumUpgradesRepository):
+    def __init__(self):
+        self.collection = MemoryCollection("premium_upgrades", unique=["session_id"])
+
+    async def get(self, session_id):
+        return _copy(self.collection.find("session_id", session_id))
+
+    async def mark_completed(self, session_id, completed_at):
+        upgrade = self.collection.find("session_id", session_id)
+        if upgrade is not None:
+            upgrade.update(status="completed", completed_at=completed_at)
+
+
+class MemoryFlightSearches(FlightSearchesRepository):
+    def __init__(self):
+        self.collection = MemoryCollection("flight_searches")
+
+    async def insert(self, search):
+        self.collection.insert(search)
+
+    async def popular(self, since, first_date, limit):
+        counts = Counter(
+            tuple(doc[field] for field in SEARCH_KEY_FIELDS)
+            for doc in self.collection.documents
+            if doc["timestamp"] >= since and doc["departure_date"] >= first_date
+        )
+        return [
+            {**dict(zip(SEARCH_KEY_FIELDS, key)), "count": count}
+            for key, count in counts.most_common(limit)
+        ]
+
+    def batches(self, start, end, after, batch_size):
+        return _memory_batches(self.collection, "timestamp", start, end, after, batch_size)
+
+
+class MemoryStatusChecks(StatusChecksRepository):
+    def __init__(self):
+        self.collection = MemoryCollection("status_checks")
+
+    async def insert(self, status_check):
+        self.collection.insert(status_check)
+
+    async def list(self, limit):
+        return [
+            _copy({k: v for k, v in doc.items() if k != "_id"})
+            for doc in self.collection.documents[:limit]
+        ]
+
+
+class MemoryPriceHistory(PriceHistoryRepository):
+    def __init__(self):
+        self.buckets: Dict[tuple, dict] = {}
+
+    async def record(self, route, observed_at, price, version):
+        day, offset = _bucket_key(observed_at)
+        bucket = self.buckets.get((route, day))
+        if bucket is None:
+            bucket = {"route": route, "day": day, "t": [], "p": [], "count": 0, "sum": 0, "min": price, "max": price, "v": None}
+            self.buckets[(route, day)] = bucket
+        elif bucket["v"] == version:
+            return
+        bucket["v"] = version
+        bucket["t"].append(offset)
+        bucket["p"].append(price)
+        del bucket["t"][:-PRICE_HISTORY_MAX_SAMPLES], bucket["p"][:-PRICE_HISTORY_MAX_SAMPLES]
+        bucket["count"] += 1
+        bucket["sum"] += price
+        bucket["min"] = min(bucket["min"], price)
+        bucket["max"] = max(bucket["max"], price)
+
+    async def range(self, route, first_day, last_day):
+        return [
+            _copy(self.buckets[key])
+            for key in sorted(self.buckets)
+            if key[0] == route and first_day <= key[1] <= last_day
+        ]
+
+
+class MemoryUsage(UsageRepository):
+    def __init__(self):
+        self.counts: Dict[Tuple[str, int], int] = {}
+
+    async def add(self, increments, expires_at):
+        for key, count in increments.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    async def load(self, window):
+        return {user: count for (user, key_window), count in self.counts.items() if key_window == window}
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.users = MemoryUsers()
+        self.payment_transactions = MemoryPaymentTransactions()
+        self.premium_upgrades = MemoryPremiumUpgrades()
+        self.flight_searches = MemoryFlightSearches()
+        self.status_checks = MemoryStatusChecks()
+        self.price_history = MemoryPriceHistory()
+        self.usage = MemoryUsage()
+
+    async def ensure_indexes(self):
+        # Unique indexes are maintained by MemoryCollection itself
+        pass
+
+    async def ping(self):
+        pass
+
+
+def create_storage() -> Storage:
+    """Storage backend selected by STORAGE_BACKEND (mongo by default)"""
+    backend = os.environ.get("STORAGE_BACKEND", "mongo").lower()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend != "mongo":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return MongoStorage(os.environ["MONGO_URL"], os.environ["DB_NAME"])
@@ -0,0 +1,238 @@
+"""
+Request-scoped timing breakdown for the FlySnipe API.
+
+TimingMiddleware gives every HTTP request a RequestTimings in a context
+variable. Code under the request records phases into it (request parsing
+and response serialization by TimedRoute, flight generation, each storage
+call, Stripe calls), and the middleware returns them in a Server-Timing
+header. The same breakdown is logged as one JSON line per request on the
+"flysnipe.requests" logger: a REQUEST_LOG_SAMPLE_RATE fraction of
+requests, plus every request that failed or recorded an error.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+request_log = logging.getLogger("flysnipe.requests")
+
+
+class RequestTimings:
+    """Phases recorded while serving one request, in milliseconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Appends are atomic, so phases may be recorded from worker threads
+        self.phases: List[Tuple[str, float]] = []
+        self.errors: List[Dict[str, str]] = []
+        self.endpoint_started: Optional[float] = None
+        # Number of phases recorded when the endpoint started
+        self.endpoint_phases: Optional[int] = None
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, name: str, milliseconds: float) -> None:
+        self.phases.append((name, milliseconds))
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Total duration and call count per phase name, in first-recorded order"""
+        summary: Dict[str, Dict[str, Any]] = {}
+        for name, milliseconds in list(self.phases):
+            phase = summary.setdefault(name, {"ms": 0.0, "calls": 0})
+            phase["ms"] += milliseconds
+            phase["calls"] += 1
+        for phase in summary.values():
+            phase["ms"] = round(phase["ms"], 2)
+        return summary
+
+    def elapsed(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        entries = []
+        for name, phase in self.summary().items():
+            entry = f"{name};dur={phase['ms']}"
+            if phase["calls"] > 1:
+                entry += f';desc="{phase["calls"]} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={round(self.elapsed(), 2)}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """Time the enclosed block as one phase of the current request, if any"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function or coroutine function as a phase"""
+
+    def decorate(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_coroutine(*args, **kwargs):
+                with phase(name):
+                    return await func(*args, **kwargs)
+            return timed_coroutine
+
+        @functools.wraps(func)
+        def timed_function(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return timed_function
+
+    return decorate
+
+
+class TimedRepository:
+    """Proxy timing each coroutine method of a repository as `<prefix>.<method>`"""
+
+    def __init__(self, repository: Any, prefix: str):
+        self._repository = repository
+        self._prefix = prefix
+
+    def __getattr__(self, attribute: str):
+        value = getattr(self._repository, attribute)
+        if inspect.iscoroutinefunction(value):
+            value = timed(f"{self._prefix}.{attribute}")(value)
+            # Cache the wrapper so later lookups skip __getattr__
+            setattr(self, attribute, value)
+        return value
+
+
+def record_error(message: str, error: Exception) -> None:
+    """Attach a handled error to the request's log line, or log it directly outside a request"""
+    timings = _current.get()
+    if timings is None:
+        logging.error(f"{message}: {str(error)}")
+        return
+    timings.errors.append({"message": message, "type": type(error).__name__, "detail": str(error)})
+
+
+class TimedRoute(APIRoute):
+    """Route recording parse (body parsing, validation and dependencies, until
+    the endpoint runs, less the phases dependencies record themselves, such
+    as admission), endpoint, and serialize (after it returns)"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        @contextmanager
+        def endpoint_timing():
+            timings = _current.get()
+            if timings is not None:
+                timings.endpoint_started = time.perf_counter()
+                timings.endpoint_phases = len(timings.phases)
+            try:
+                yield
+            finally:
+                if timings is not None:
+                    timings.endpoint_finished = time.perf_counter()
+
+        # Plain def endpoints keep a plain wrapper, so FastAPI still runs them
+        # in its threadpool (which copies the request's context)
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                with endpoint_timing():
+                    return await endpoint(*args, **kwargs)
+        else:
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kwargs):
+                with endpoint_timing():
+                    return endpoint(*args, **kwargs)
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _current.get()
+            started = time.perf_counter()
+            first_phase = len(timings.phases) if timings is not None else 0
+            try:
+                response = await handler(request)
+            finally:
+                if timings is not None and timings.endpoint_started is not None:
+                    # Admission waits and tier lookups are reported as their own phases
+                    nested = sum(ms for _, ms in timings.phases[first_phase:timings.endpoint_phases])
+                    parse = (timings.endpoint_started - started) * 1000 - nested
+                    # Listed first, ahead of the phases recorded inside the endpoint
+                    timings.phases.insert(0, ("parse", max(0.0, parse)))
+                    if timings.endpoint_finished is not None:
+                        timings.add("endpoint", (timings.endpoint_finished - timings.endpoint_started) * 1000)
+            if timings is not None and timings.endpoint_finished is not None:
+                timings.add("serialize", (time.perf_counter() - timings.endpoint_finished) * 1000)
+            return response
+
+        return timed_handler
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp, sample_rate: float = 0.01) -> None:
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+                headers.append("Timing-Allow-Origin", "*")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            timings.errors.append({"message": "Unhandled error", "type": type(e).__name__, "detail": str(e)})
+            raise
+        finally:
+            _current.reset(token)
+            if status >= 500 or timings.errors or random.random() < self.sample_rate:
+                self.log(scope, status, timings)
+
+    def log(self, scope: Scope, status: int, timings: RequestTimings) -> None:
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(timings.elapsed(), 2),
+            "phases": timings.summary(),
+        }
+        if timings.errors:
+            record["errors"] = timings.errors
+        line = json.dumps(record)
+        if timings.errors or status >= 500:
+            request_log.error(line)
+        else:
+            request_log.info(line)
@@ -0,0 +1,160 @@
+"""
+Search result cache and its prewarming.
+
+Search results are fixed for a query within one result window
+(SEARCH_RESULT_TTL), so full result rows are cached by fingerprint. At
+startup the warmer reads the most repeated recent searches from
+flight_searches and precomputes them with bounded concurrency; afterwards
+it computes them for each next window shortly before the current one
+expires, so popular routes are never cold, even right after a deploy.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from storage import Storage
+
+# Precomputes one search (a flight_searches.popular entry) for a result window
+WarmSearch = Callable[[dict, int], Awaitable[None]]
+
+
+class SearchCache:
+    """Search results by fingerprint, bounded to the most recently used"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return fingerprint in self._entries
+
+    def get(self, fingerprint: str) -> Optional[Any]:
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(fingerprint)
+        self.hits += 1
+        return entry
+
+    def put(self, fingerprint: str, entry: Any) -> None:
+        # Fingerprints change every window, so old windows simply age out
+        self._entries[fingerprint] = entry
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def metrics(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CacheWarmer:
+    """Precomputes the most popular searches for the current and each next result window"""
+
+    def __init__(
+        self,
+        storage: Storage,
+        warm_search: WarmSearch,
+        window: int,
+        routes: int,
+        concurrency: int,
+        timeout: float,
+        lookback_hours: float,
+        lead: float,
+    ):
+        self.storage = storage
+        self.warm_search = warm_search
+        self.window = window
+        self.routes = routes
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lookback_hours = lookback_hours
+        # Refreshing must start inside the window it refreshes ahead of
+        self.lead = min(lead, window / 2)
+
+        self.ready = False
+        self.warmed = 0
+        self.failed = 0
+        self.last_warmed_version: Optional[int] = None
+
+    async def popular(self) -> List[dict]:
+        now = datetime.utcnow()
+        return await self.storage.flight_searches.popular(
+            since=now - timedelta(hours=self.lookback_hours),
+            first_date=now.strftime("%Y-%m-%d"),
+            limit=self.routes,
+        )
+
+    async def warm(self, version: int) -> None:
+        """Precompute the popular searches for one result window"""
+        if self.routes <= 0:
+            return
+        try:
+            searches = await self.popular()
+        except Exception as e:
+            logging.error(f"Cache warmup error: {str(e)}")
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm_one(search: dict):
+            async with semaphore:
+                try:
+                    await self.warm_search(search, version)
+                    self.warmed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"Cache warmup error for {search['from_city']}-{search['to_city']}: {str(e)}")
+
+        await asyncio.gather(*(warm_one(search) for search in searches))
+        self.last_warmed_version = version
+
+    async def run(self) -> None:
+        """Warm the current window, then each next one `lead` seconds before it starts"""
+        version = int(time.time() // self.window)
+        initial = asyncio.create_task(self.warm(version))
+        done, _ = await asyncio.wait({initial}, timeout=self.timeout)
+        if not done:
+            logging.warning(f"Cache warmup still running after {self.timeout}s; reporting ready")
+        # Past the time limit the server takes traffic while warmup finishes
+        self.ready = True
+        await initial
+
+        while True:
+            version = max(version + 1, int(time.time() // self.window) + 1)
+            await asyncio.sleep(max(0.0, version * self.window - self.lead - time.time()))
+            await self.warm(version)
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "last_warmed_version": self.last_warmed_version,
+        }
+
+
+def build_warmer(storage: Storage, warm_search: WarmSearch, window: int) -> CacheWarmer:
+    """Create the warmer, overridable via WARMUP_* env vars"""
+    return CacheWarmer(
+        storage,
+        warm_search,
+        window=window,
+        routes=int(os.environ.get("WARMUP_ROUTES", "100")),
+        concurrency=int(os.environ.get("WARMUP_CONCURRENCY", "4")),
+        timeout=float(os.environ.get("WARMUP_TIMEOUT_S", "15")),
+        lookback_hours=float(os.environ.get("WARMUP_LOOKBACK_HOURS", "24")),
+        lead=float(os.environ.get("WARMUP_LEAD_S", "30")),
+    )
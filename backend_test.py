@@ -7,7 +7,11 @@ Tests all critical endpoints for the flight search API
 import requests
 import json
 import uuid
+import sys
+import atexit
+from contextlib import ExitStack
 from datetime import datetime, timedelta
+from pathlib import Path
 import os
 from dotenv import load_dotenv
 
@@ -16,6 +20,22 @@ load_dotenv('/app/frontend/.env')
 
 # Get backend URL from frontend environment
 BACKEND_URL = os.getenv('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+
+# --in-process (or BACKEND_IN_PROCESS=1) runs the scenarios against the app
+# itself with the in-memory storage backend, without a server or MongoDB
+IN_PROCESS = "--in-process" in sys.argv or os.getenv('BACKEND_IN_PROCESS') == '1'
+if IN_PROCESS:
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    from fastapi.testclient import TestClient
+    import server
+
+    _in_process = ExitStack()
+    atexit.register(_in_process.close)
+    # Same get/post interface as the requests module, served by the ASGI app
+    requests = _in_process.enter_context(TestClient(server.create_app()))
+    BACKEND_URL = 'http://testserver'
+
 API_BASE_URL = f"{BACKEND_URL}/api"
 
 print(f"Testing backend at: {API_BASE_URL}")
@@ -76,12 +76,15 @@ async function loadSearchResults() {
         // Update search details display
         searchDetails.textContent = `${searchParams.from} → ${searchParams.to} • ${searchParams.date} • ${searchParams.passengers} passenger${searchParams.passengers > 1 ? 's' : ''}`;
         
-        // Fetch flights
+        // Fetch flights, on the signed-in user's quota when there is a session
+        const headers = { 'Content-Type': 'application/json' };
+        const { sessionToken } = await chrome.storage.local.get(['sessionToken']);
+        if (sessionToken) {
+            headers['Authorization'] = `Bearer ${sessionToken}`;
+        }
         const response = await fetch(`${BACKEND_URL}/api/flights/search`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers,
             body: JSON.stringify({
                 from: searchParams.from,
                 to: searchParams.to,
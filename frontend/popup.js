@@ -82,19 +82,40 @@ function updateUIForLoggedInUser() {
     }
 }
 
-// Mock login (replace with real Google auth later)
+// Login (the backend verifies a mock token for now; replace with real Google auth later)
 loginBtn.addEventListener('click', async () => {
-    // For now, simulate login
-    const mockEmail = 'user@example.com';
-    currentUser = mockEmail;
-    isPremium = false;
-    
-    await chrome.storage.local.set({ 
-        userEmail: mockEmail, 
-        isPremium: false 
-    });
-    
-    updateUIForLoggedInUser();
+    try {
+        const response = await fetch(`${BACKEND_URL}/api/auth/google`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ id_token: 'mock-google-id-token' })
+        });
+        
+        if (!response.ok) {
+            throw new Error('Failed to sign in');
+        }
+        
+        const user = await response.json();
+        const premiumResponse = await fetch(`${BACKEND_URL}/api/check-premium?email=${encodeURIComponent(user.email)}`);
+        const premium = premiumResponse.ok ? await premiumResponse.json() : {};
+        
+        currentUser = user.email;
+        isPremium = premium.is_premium || false;
+        
+        // The session token puts searches on this account's quota
+        await chrome.storage.local.set({ 
+            userEmail: user.email, 
+            isPremium: isPremium,
+            sessionToken: user.session_token
+        });
+        
+        updateUIForLoggedInUser();
+    } catch (error) {
+        console.error('Login error:', error);
+        alert('Error signing in. Please try again.');
+    }
 });
 
 // Logout
@@ -125,6 +146,16 @@ searchBtn.addEventListener('click', async () => {
     await searchFlights();
 });
 
+// Request headers, with the session token for signed-in users
+async function apiHeaders() {
+    const headers = { 'Content-Type': 'application/json' };
+    const stored = await chrome.storage.local.get(['sessionToken']);
+    if (stored.sessionToken) {
+        headers['Authorization'] = `Bearer ${stored.sessionToken}`;
+    }
+    return headers;
+}
+
 // Search flights API call
 async function searchFlights() {
     try {
@@ -132,9 +163,7 @@ async function searchFlights() {
         
         const response = await fetch(`${BACKEND_URL}/api/flights/search`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: await apiHeaders(),
             body: JSON.stringify({
                 from: currentSearch.from,
                 to: currentSearch.to,
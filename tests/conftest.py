@@ -0,0 +1,8 @@
+"""Backend tests run against the app modules directly, on the in-memory storage backend"""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import admission
+from admission import AdmissionGate, ClientBuckets, client_key
+
+
+def gate(**overrides):
+    options = {"concurrency": 1, "queue_size": 1, "queue_timeout": 0.05, "rate": 1000.0, "burst": 1000.0}
+    options.update(overrides)
+    return AdmissionGate("search", **options)
+
+
+def test_bucket_admits_burst_then_rate_limits_per_client():
+    buckets = ClientBuckets(rate=1.0, burst=3)
+    assert [buckets.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    retry_after = buckets.take("a")
+    assert 0 < retry_after <= 1.0
+    # Other clients have their own buckets
+    assert buckets.take("b") == 0.0
+
+
+def test_bucket_refills_at_rate(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: clock[0])
+    buckets = ClientBuckets(rate=2.0, burst=1)
+    assert buckets.take("a") == 0.0
+    assert buckets.take("a") == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert buckets.take("a") == 0.0
+
+
+def test_gate_sheds_rate_limited_clients_with_429():
+    async def scenario():
+        limited = gate(burst=1, rate=0.5)
+        await limited.acquire("ip:1")
+        limited.release()
+        with pytest.raises(HTTPException) as shed:
+            await limited.acquire("ip:1")
+        return limited, shed.value
+
+    limited, shed = asyncio.run(scenario())
+    assert shed.status_code == 429
+    assert shed.headers["Retry-After"] == "2"
+    assert limited.metrics()["shed"]["rate_limited"] == 1
+
+
+def test_gate_sheds_when_queue_is_full():
+    async def scenario():
+        busy = gate(queue_timeout=1.0)
+        await busy.acquire("ip:1")
+        queued = asyncio.create_task(busy.acquire("ip:2"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as shed:
+            await busy.acquire("ip:3")
+        busy.release()
+        await queued
+        busy.release()
+        return busy, shed.value
+
+    busy, shed = asyncio.run(scenario())
+    assert shed.status_code == 503
+    metrics = busy.metrics()
+    assert metrics["shed"]["queue_full"] == 1
+    assert metrics["admitted"] == 2
+    assert metrics["max_queue_depth"] == 1
+    assert metrics["in_flight"] == 0
+
+
+def test_gate_sheds_queued_requests_after_timeout():
+    async def scenario():
+        busy = gate()
+        await busy.acquire("ip:1")
+        with pytest.raises(HTTPException) as shed:
+            await busy.acquire("ip:2")
+        busy.release()
+        return busy, shed.value
+
+    busy, shed = asyncio.run(scenario())
+    assert shed.status_code == 503
+    assert busy.metrics()["shed"]["queue_timeout"] == 1
+    assert busy.metrics()["queue_depth"] == 0
+
+
+def request(headers=None, peer="10.0.0.1"):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "headers": raw, "client": (peer, 1234)})
+
+
+def test_client_key_uses_trusted_proxy_hop(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXY_COUNT", 1)
+    spoofed = {"X-Forwarded-For": "1.1.1.1, 203.0.113.9", "X-User-Email": "premium@example.com"}
+    assert client_key(request(spoofed)) == "ip:203.0.113.9"
+    assert client_key(request()) == "ip:10.0.0.1"
+
+    monkeypatch.setattr(admission, "TRUSTED_PROXY_COUNT", 0)
+    assert client_key(request(spoofed)) == "ip:10.0.0.1"
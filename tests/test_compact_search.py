@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ROUTED = {"from": "New York", "to": "London", "departureDate": "2030-06-01"}
+UNROUTED = {"from": "Springfield", "to": "Shelbyville", "departureDate": "2030-06-01"}
+
+
+@pytest.fixture
+def client():
+    with TestClient(server.create_app()) as client:
+        yield client
+
+
+@pytest.mark.parametrize("search", [ROUTED, UNROUTED])
+def test_fields_selects_only_those_fields(client, search):
+    response = client.post("/api/flights/search", params={"fields": "price,departure.time"}, json=search)
+    assert response.status_code == 200
+    flights = response.json()["flights"]
+    assert flights
+    assert all(set(flight) == {"price", "departure"} and set(flight["departure"]) == {"time"} for flight in flights)
+    prices = [flight["price"] for flight in flights]
+    assert prices == sorted(prices)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_connection_fields_on_unrouted_cities(client, compact):
+    params = {"fields": "price,layovers,segments", "compact": compact}
+    # Served once from a fresh computation and once from the cached full rows
+    for _ in range(2):
+        response = client.post("/api/flights/search", params=params, json=UNROUTED)
+        assert response.status_code == 200
+        body = response.json()
+        if compact:
+            columns = body["flights"]
+            assert columns["layovers"] == columns["segments"] == [None] * len(columns["price"])
+        else:
+            assert all(flight["layovers"] is None and flight["segments"] is None for flight in body["flights"])
+        client.post("/api/flights/search", json=UNROUTED)
+
+
+def test_unknown_fields_are_rejected(client):
+    response = client.post("/api/flights/search", params={"fields": "price,secret"}, json=UNROUTED)
+    assert response.status_code == 400
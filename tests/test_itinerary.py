@@ -0,0 +1,29 @@
+import itertools
+import random
+
+from itinerary import k_cheapest_combinations
+
+
+def test_k_cheapest_combinations_matches_brute_force():
+    rng = random.Random(7)
+    for _ in range(50):
+        legs = [sorted(rng.randint(50, 500) for _ in range(rng.randint(1, 6))) for _ in range(rng.randint(1, 4))]
+        k = rng.randint(1, 20)
+        expected = sorted(sum(combination) for combination in itertools.product(*legs))[:k]
+
+        results = k_cheapest_combinations(legs, k, price=lambda fare: fare)
+
+        assert [total for total, _ in results] == expected
+        assert all(total == sum(options) for total, options in results)
+
+
+def test_k_cheapest_combinations_returns_each_combination_once():
+    legs = [[100, 100, 120], [80, 80]]
+    results = k_cheapest_combinations([list(enumerate(leg)) for leg in legs], 10, price=lambda option: option[1])
+    indices = [tuple(index for index, _ in options) for _, options in results]
+    assert len(indices) == 6
+    assert len(set(indices)) == 6
+
+
+def test_k_cheapest_combinations_empty_leg():
+    assert k_cheapest_combinations([[100], []], 5, price=lambda fare: fare) == []
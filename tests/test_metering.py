@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import server
+from metering import UsageMeter
+from storage import MemoryStorage
+
+
+def meter(storage, free=5):
+    return UsageMeter(storage, window=3600, quotas={"free": free, "premium": 100}, flush_interval=10, tier_ttl=60)
+
+
+def test_flush_writes_aggregated_counts_and_reload_restores_them():
+    async def scenario():
+        storage = MemoryStorage()
+        first = meter(storage)
+        for _ in range(3):
+            assert first.count("ip:1", "free") == 0
+        first.count("ip:2", "free")
+        await first.flush()
+
+        # A restarted worker picks the window's counts back up
+        restarted = meter(storage)
+        await restarted.load()
+        return first, restarted
+
+    first, restarted = asyncio.run(scenario())
+    assert first.pending == {}
+    assert first.metrics()["flushed_updates"] == 2
+    assert restarted.counts == {"ip:1": 3, "ip:2": 1}
+
+
+def test_flush_merges_counts_from_other_workers():
+    async def scenario():
+        storage = MemoryStorage()
+        a, b = meter(storage), meter(storage)
+        for _ in range(3):
+            a.count("ip:1", "free")
+        for _ in range(2):
+            b.count("ip:1", "free")
+        await a.flush()
+        await b.flush()
+        await a.flush()
+        return a, b
+
+    a, b = asyncio.run(scenario())
+    assert a.counts["ip:1"] == b.counts["ip:1"] == 5
+    # The quota is shared, not five per worker
+    assert a.count("ip:1", "free") > 0
+    assert b.count("ip:1", "free") > 0
+
+
+def test_reload_keeps_unflushed_counts():
+    async def scenario():
+        storage = MemoryStorage()
+        other = meter(storage)
+        other.count("ip:1", "free")
+        await other.flush()
+
+        local = meter(storage)
+        local.count("ip:1", "free")
+        await local.load()
+        return local
+
+    local = asyncio.run(scenario())
+    assert local.counts["ip:1"] == 2
+
+
+def test_failed_flush_requeues_pending():
+    class FailingUsage:
+        async def add(self, increments, expires_at):
+            raise RuntimeError("database down")
+
+    class FailingStorage:
+        usage = FailingUsage()
+
+    failing = meter(FailingStorage())
+    failing.count("ip:1", "free")
+    asyncio.run(failing.flush())
+    assert sum(failing.pending.values()) == 1
+
+
+def test_refund_after_flush_writes_a_negative_increment():
+    async def scenario():
+        storage = MemoryStorage()
+        usage = meter(storage)
+        now = time.time()
+        usage.count("ip:1", "free", now)
+        await usage.flush()
+        usage.refund("ip:1", now)
+        await usage.flush()
+        return storage, usage
+
+    storage, usage = asyncio.run(scenario())
+    assert usage.counts.get("ip:1", 0) == 0
+    assert asyncio.run(storage.usage.load(usage._current)) == {"ip:1": 0}
+
+
+def test_only_served_searches_count_against_the_quota():
+    search = {"from": "New York", "to": "London", "departureDate": "2030-06-01"}
+    with TestClient(server.create_app()) as client:
+        assert client.post("/api/flights/search", params={"fields": "bogus"}, json=search).status_code == 400
+        assert client.post("/api/flights/search", json={"from": "New York"}).status_code == 422
+        assert client.get("/api/flights/search", params={**search, "departureDate": "June 1"}).status_code == 422
+        assert client.get("/api/usage").json()["used"] == 0
+
+        assert client.post("/api/flights/search", json=search).status_code == 200
+        assert client.post("/api/flights/itineraries", json={**search, "returnDate": "2030-06-08"}).status_code == 200
+        # Client-chosen emails do not move the search onto another account
+        usage = client.get("/api/usage", headers={"X-User-Email": "premium@example.com"}).json()
+        assert usage["used"] == 2
+        assert usage["tier"] == "free"
+
+
+def test_shutdown_flush_only_writes():
+    class RecordingUsage:
+        def __init__(self):
+            self.calls = []
+
+        async def add(self, increments, expires_at):
+            self.calls.append("add")
+
+        async def load(self, window):
+            self.calls.append("load")
+            return {}
+
+    class RecordingStorage:
+        usage = RecordingUsage()
+
+    usage = meter(RecordingStorage())
+    asyncio.run(usage.flush(reload=False))
+    usage.count("ip:1", "free")
+    asyncio.run(usage.flush(reload=False))
+    assert RecordingStorage.usage.calls == ["add"]
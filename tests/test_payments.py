@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from server import settle_payment
+from storage import MemoryStorage
+
+
+async def pending_transaction(storage, email="buyer@example.com"):
+    await storage.payment_transactions.insert({
+        "session_id": "cs_test",
+        "email": email,
+        "package_id": "monthly",
+        "amount": 9.99,
+        "payment_status": "pending",
+    })
+
+
+def test_racing_settlements_upgrade_exactly_once():
+    async def scenario():
+        storage = MemoryStorage()
+        await pending_transaction(storage)
+        updates = []
+        update = storage.users.update
+
+        async def counted_update(*args, **kwargs):
+            updates.append(args[0])
+            await update(*args, **kwargs)
+
+        storage.users.update = counted_update
+        # A status poll and webhook retries arriving together
+        settled = await asyncio.gather(*(settle_payment(storage, "cs_test") for _ in range(5)))
+        return storage, settled, updates
+
+    storage, settled, updates = asyncio.run(scenario())
+    assert settled.count(True) == 1
+    assert updates == ["buyer@example.com"]
+    user = asyncio.run(storage.users.get("buyer@example.com"))
+    assert user["is_premium"] is True
+    assert user["subscription_type"] == "monthly"
+
+
+def test_failed_upgrade_leaves_transaction_settleable():
+    async def scenario():
+        storage = MemoryStorage()
+        await pending_transaction(storage)
+        update = storage.users.update
+
+        async def failing_update(*args, **kwargs):
+            raise RuntimeError("database down")
+
+        storage.users.update = failing_update
+        with pytest.raises(RuntimeError):
+            await settle_payment(storage, "cs_test")
+
+        storage.users.update = update
+        retried = await settle_payment(storage, "cs_test")
+        return storage, retried
+
+    storage, retried = asyncio.run(scenario())
+    assert retried is True
+    assert asyncio.run(storage.users.get("buyer@example.com"))["is_premium"] is True
+
+
+def test_unknown_session_is_not_settled():
+    assert asyncio.run(settle_payment(MemoryStorage(), "cs_missing")) is False
@@ -0,0 +1,38 @@
+from route_graph import AirportInfo, Leg, RouteNetwork
+
+
+def network(routes):
+    codes = sorted({code for route in routes for code in route[:2]})
+    airports = [AirportInfo(code, code, code.lower(), 0.0, float(i), 30) for i, code in enumerate(codes)]
+    legs = [
+        Leg(i, "XX", f"XX{i}", origin, destination, 60, price, "A320", (480,))
+        for i, (origin, destination, price) in enumerate(routes)
+    ]
+    return RouteNetwork(airports, {"XX": "Test Air"}, legs)
+
+
+def test_yen_paths_ascend_in_cost_and_are_loopless():
+    routes = [
+        ("A", "D", 500),
+        ("A", "B", 100), ("B", "D", 150),
+        ("A", "C", 120), ("C", "D", 200),
+        ("B", "C", 10), ("C", "B", 10),
+        ("B", "A", 5),
+    ]
+    paths = network(routes).k_shortest_paths("A", "D", k=10, max_stops=3)
+    costs = [sum(leg.price for leg in path) for path in paths]
+
+    # Every loopless A->D path: ABD, ACBD, ABCD, ACD, AD
+    assert costs == [250, 280, 310, 320, 500]
+    for path in paths:
+        airports = [path[0].origin] + [leg.destination for leg in path]
+        assert airports[0] == "A" and airports[-1] == "D"
+        assert len(set(airports)) == len(airports)
+        assert all(a.destination == b.origin for a, b in zip(path, path[1:]))
+
+
+def test_yen_respects_k_and_max_stops():
+    routes = [("A", "B", 100), ("B", "C", 100), ("C", "D", 100), ("A", "D", 1000)]
+    paths = network(routes).k_shortest_paths("A", "D", k=5, max_stops=1)
+    assert [[leg.index for leg in path] for path in paths] == [[3]]
+    assert len(network(routes).k_shortest_paths("A", "D", k=1, max_stops=2)) == 1
@@ -0,0 +1,42 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+SEARCH = {"from": "New York", "to": "London", "departureDate": "2030-06-01"}
+
+
+@pytest.fixture
+def client():
+    with TestClient(server.create_app()) as client:
+        yield client
+
+
+def test_matching_etag_answers_304(client):
+    first = client.get("/api/flights/search", params=SEARCH)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+
+    revalidated = client.get("/api/flights/search", params=SEARCH, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    assert "max-age=" in revalidated.headers["cache-control"]
+
+
+def test_etag_compares_weakly_and_per_representation(client):
+    etag = client.get("/api/flights/search", params=SEARCH).headers["etag"]
+    strong = etag.removeprefix("W/")
+    assert client.get("/api/flights/search", params=SEARCH, headers={"If-None-Match": strong}).status_code == 304
+    assert client.get("/api/flights/search", params=SEARCH, headers={"If-None-Match": "*"}).status_code == 304
+
+    trimmed = client.get("/api/flights/search", params={**SEARCH, "fields": "price"})
+    assert trimmed.headers["etag"] != etag
+    assert client.get("/api/flights/search", params={**SEARCH, "fields": "price"}, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_stale_etag_gets_full_response(client):
+    response = client.get("/api/flights/search", params=SEARCH, headers={"If-None-Match": 'W/"stale"'})
+    assert response.status_code == 200
+    assert response.json()["flights"]
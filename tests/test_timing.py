@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from timing import TimedRoute, TimingMiddleware, phase
+
+
+async def slow_dependency():
+    with phase("admission"):
+        await asyncio.sleep(0.05)
+
+
+def app():
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.get("/async", dependencies=[Depends(slow_dependency)])
+    async def async_endpoint():
+        return {"ok": True}
+
+    @router.get("/sync")
+    def sync_endpoint():
+        return {"thread": threading.current_thread().name}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(TimingMiddleware, sample_rate=0)
+    return app
+
+
+def phases(response):
+    entries = {}
+    for entry in response.headers["server-timing"].split(", "):
+        name, _, rest = entry.partition(";dur=")
+        entries[name] = float(rest.split(";")[0])
+    return entries
+
+
+def test_parse_excludes_phases_recorded_by_dependencies():
+    with TestClient(app()) as client:
+        timings = phases(client.get("/async"))
+    assert list(timings)[:2] == ["parse", "admission"]
+    assert timings["admission"] >= 50
+    assert timings["parse"] < 25
+    assert {"endpoint", "serialize", "total"} <= set(timings)
+
+
+def test_sync_endpoints_run_in_the_threadpool_and_are_timed():
+    with TestClient(app()) as client:
+        response = client.get("/sync")
+    assert response.status_code == 200
+    assert response.json()["thread"] != threading.main_thread().name
+    assert {"parse", "endpoint", "serialize"} <= set(phases(response))